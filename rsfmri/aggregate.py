@@ -0,0 +1,148 @@
+#!/usr/bin/python
+
+import os
+import numpy as np
+
+# our imports
+from settings import *
+
+##########################
+# group aggregates
+##########################
+
+# persisted sufficient statistics (n, sum, sum of squares) of per-session
+# values (masked voxels of a map, or a connectivity matrix), together with
+# the sessions that contributed. Adding/removing sessions only touches
+# those sessions' values.
+#  * key: identifies the layout of the values (e.g., seed names); stats
+#         stored with a different key are discarded
+#  * stamps: per session, identifies the values that were added (e.g. file
+#            mtime), so recomputed values replace the old ones (see update)
+class SufficientStats(object):
+    def __init__(self, filename, key=None):
+        self.filename = filename
+        self.key      = [str(k) for k in key] if key is not None else None
+        self.reset()
+
+        if os.path.isfile(self.filename):
+            self.load()
+
+    def reset(self):
+        self.sessions = []
+        self.stamps   = {}
+        self.sum      = 0.
+        self.sumsq    = 0.
+
+    def load(self):
+        data = np.load(self.filename)
+        key  = list(data['key']) if 'key' in data.files else None
+
+        if key != self.key:
+            log.info('Stored stats do not match current layout, rebuilding: {}'.format(self.filename))
+            return
+
+        self.sessions = list(data['sessions'])
+        if 'stamps' in data.files:
+            self.stamps = dict((s, t) for s, t in zip(self.sessions, data['stamps']) if t)
+        self.sum      = data['sum']
+        self.sumsq    = data['sumsq']
+
+    def save(self):
+        arrays = {'sessions': np.array(self.sessions, dtype=str),
+                  'stamps':   np.array([self.stamps.get(s) or '' for s in self.sessions], dtype=str),
+                  'sum':      np.asarray(self.sum),
+                  'sumsq':    np.asarray(self.sumsq)}
+        if self.key is not None:
+            arrays['key'] = np.array(self.key, dtype=str)
+
+        # write then move (never leave a partial file behind)
+        tmp = '{}.tmp.npz'.format(self.filename[:-len('.npz')])
+        np.savez(tmp, **arrays)
+        os.rename(tmp, self.filename)
+
+    @property
+    def n(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def add(self, session_id, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.sessions.append(session_id)
+        self.sum   = self.sum + values
+        self.sumsq = self.sumsq + values**2
+
+    def remove(self, session_id, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.sessions.remove(session_id)
+        self.stamps.pop(session_id, None)
+        self.sum   = self.sum - values
+        self.sumsq = self.sumsq - values**2
+
+    # bring stats in line with current sessions
+    #  * load_current(id): values of a current session
+    #  * load_removed(id): values that were added for a session (of a removed
+    #                      session, or before they were recomputed; returns
+    #                      None if they are no longer available). Default:
+    #                      current values, if they are still the same
+    #  * stamp(id):        identifies the current values of a session (None
+    #                      if unknown); sessions whose stamp changed are
+    #                      replaced (their old values subtracted first)
+    # returns (added, removed) session ids (replaced sessions are in both)
+    def update(self, session_ids, load_current, load_removed=None, stamp=None):
+        stamp = stamp or (lambda session_id: None)
+
+        # stats of earlier versions have no stamps: current values are assumed
+        for session_id in self.sessions:
+            if session_id not in self.stamps and session_id in session_ids:
+                self.stamps[session_id] = stamp(session_id)
+
+        changed = [s for s in self.sessions if s in session_ids and self.stamps.get(s) != stamp(s)]
+        removed = [s for s in self.sessions if s not in session_ids] + changed
+
+        def old_values(session_id):
+            if load_removed is not None:
+                return load_removed(session_id)
+            if session_id in self.stamps and self.stamps[session_id] != stamp(session_id):
+                return None
+            return load_current(session_id)
+
+        # values of removed sessions are needed to subtract them
+        old = [(s, old_values(s)) for s in removed]
+        if any(v is None for _,v in old):
+            log.warning('Values of removed/recomputed session(s) unavailable, rebuilding: {}'.format(self.filename))
+            self.reset()
+            old = []
+
+        for session_id, values in old:
+            self.remove(session_id, values)
+
+        added = [s for s in session_ids if s not in self.sessions]
+        for session_id in added:
+            self.add(session_id, load_current(session_id))
+            self.stamps[session_id] = stamp(session_id)
+
+        return added, removed
+
+    # statistics need at least 1 (mean) or 2 (std, t) sessions
+    def _check_n(self, n):
+        if self.n < n:
+            raise ValueError('{} session(s) in {}, need at least {}'.format(self.n, self.filename, n))
+
+    def mean(self):
+        self._check_n(1)
+        return self.sum / self.n
+
+    def std(self):
+        self._check_n(2)
+        var = (self.sumsq - self.n * self.mean()**2) / (self.n - 1)
+        return np.sqrt(np.maximum(var, 0))
+
+    # one-sample t statistic (mean vs 0)
+    def tstat(self):
+        se = self.std() / np.sqrt(self.n)
+        t  = np.zeros(np.shape(se))
+        valid = se > 0
+        t[valid] = self.mean()[valid] / se[valid]
+        return t
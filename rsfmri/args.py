@@ -14,9 +14,19 @@ from settings import *
 # helper (file)
 def file_input_type(x):
     if not os.path.exists(x):
-        log.error('File cannot be found: {}'.format(x))
+        raise argparse.ArgumentTypeError('File cannot be found: {}'.format(x))
     return x
 
+# worker mode (pulls tasks from the spool of an existing project)
+def parse_worker_args():
+    parser = argparse.ArgumentParser(description='Run rs-fmri functional connectivity tasks from a work spool')
+    parser.add_argument('--worker', metavar='path', type=file_input_type, required=True,
+                        help='Project directory (<output>/<label>) of a run started with --spool')
+    parser.add_argument('--threads', metavar='n', type=int,
+                        help='Number of tasks to run at once (default: free cores)')
+    return parser.parse_args()
+
+
 def parse_args():
     parser    = argparse.ArgumentParser(description='Run rs-fmri functional connectivity')
     maingroup = parser.add_argument_group(title='required')
@@ -31,7 +41,7 @@ def parse_args():
     maingroup.add_argument('--input', '-i', metavar='path', type=file_input_type, dest='sessdir',
                            help='Input directory containing pre-processed session directories',
                            required=True)
-    maingroup.add_argument('--output', '-o', metavar='path', type=file_input_type,
+    maingroup.add_argument('--output', '-o', metavar='path',
                            help='Output directory (will create child directory with analysis label name)',
                            required=True)
     maingroup.add_argument('--label', '-l', metavar='name',
@@ -58,30 +68,96 @@ def parse_args():
                           help="Run voxelwise correlations (map)")
     actgroup.add_argument('--matrix', action='store_true', dest='matrix', default=False,
                           help='Run ROI-ROI correlations (corr. matrix)')
+    actgroup.add_argument('--dynamic', action='store_true', dest='dynamic', default=False,
+                          help='Run sliding-window ROI-ROI correlations (dynamic connectivity)')
+    actgroup.add_argument('--alff', action='store_true', default=False,
+                          help='Compute ALFF and fALFF maps (band {}-{} Hz)'.format(bpss_lo, bpss_hi))
+    actgroup.add_argument('--reho', action='store_true', default=False,
+                          help='Compute ReHo maps (Kendall\'s W of voxel neighborhoods)')
     actgroup.add_argument('--ttest', action='store_true', default=False, dest='ttest',
                           help="Run group-level t-tests")
     actgroup.add_argument('--skip-group-stats', action='store_false', dest='group_stats',
                           help='Skip all group-level stats; default is to run')
     actgroup.add_argument('--overwrite', '-W', action='store_true',
                           help='Force overwrite of existing output files')
+    actgroup.add_argument('--update', action='store_true', default=False,
+                          help='Update existing results: only sessions/seeds not yet in the group stats are run, '
+                               'removed sessions are dropped from the group stats')
+    actgroup.add_argument('--resume', action='store_true', default=False,
+                          help='Resume an interrupted/failed run: tasks that succeeded (see journal.jsonl in '
+                               'the output directory) are skipped, failed and missing tasks are run again')
+    actgroup.add_argument('--spool', action='store_true', default=False,
+                          help='Queue session/seed and group tasks in a spool in the output directory; '
+                               'other hosts can help by running: rsfmri_conn --worker <output>/<label>')
+    actgroup.add_argument('--skip-invalid', action='store_true', default=False, dest='skip_invalid',
+                          help='Drop sessions that fail header validation; default is to stop')
 
     # options
     parser.add_argument('--radius', '-r', metavar='x', type=int,
                         help='Spherical radius (in mm) of seeds (required with --seed and overwrites any radius specified when using --coordlist)')
     parser.add_argument('--fwhm', '--smoothing', metavar='0/4/6', type=int, default=6, choices=[0,4,6],
                         help='Kernel size (in mm) for fwhm smoothing of preprocessed images (default 6mm; possible options: 0,4,6)')
+    parser.add_argument('--matrix-estimator', metavar='name', default='pearson',
+                        choices=['pearson','partial','ledoit-wolf','oas'], dest='matrix_estimator',
+                        help='Estimator of ROI-ROI matrices: pearson, partial (correlation), '
+                             'ledoit-wolf or oas (partial correlation from shrunk covariance); default pearson')
+    parser.add_argument('--masked-storage', metavar='float32/float16', choices=['float32','float16'],
+                        dest='masked_storage',
+                        help='Store z-maps as in-brain-mask voxels only, one sessions x voxels file per seed '
+                             '(float32 is lossless; see rsfmri_masked2nii to convert back to nifti)')
+    parser.add_argument('--glm', metavar='file', type=file_input_type, dest='glm',
+                        help='Run voxelwise group GLM on z-maps with covariates from csv file '
+                             '(first column is session ID; text columns are treated as factors)')
+    parser.add_argument('--glm-columns', metavar='a,b,..', dest='glm_columns',
+                        help='Covariate columns to include in GLM (default: all)')
+    parser.add_argument('--contrast', metavar='name:col=w,..', action='append', dest='contrasts',
+                        help='GLM contrast over design columns, e.g. \'ad_vs_cn:group[AD]=1\'. '
+                             'Can use multiple times (default: one per design column).')
+    parser.add_argument('--reho-neighbors', metavar='7/19/27', type=int, default=reho_neighbors,
+                        choices=[7,19,27], dest='reho_neighbors',
+                        help='Voxels in ReHo neighborhood (default {})'.format(reho_neighbors))
+    parser.add_argument('--window', metavar='frames', type=int, default=30,
+                        help='Sliding window length (in frames) for --dynamic (default 30)')
+    parser.add_argument('--step', metavar='frames', type=int, default=1,
+                        help='Sliding window step (in frames) for --dynamic (default 1)')
+    parser.add_argument('--states', metavar='k', type=int, default=0,
+                        help='Cluster all windows into k connectivity states (k-means) for --dynamic (default off)')
+    parser.add_argument('--retries', metavar='n', type=int, default=task_retries,
+                        help='Attempts after a transient task failure (failed command, i/o error; default {})' \
+                                .format(task_retries))
+    parser.add_argument('--demean-runs', metavar='none/mean/zscore', default='none', choices=['none','mean','zscore'],
+                        help='Normalization of each run of multi-run sessions before runs are combined (default none)')
 
     # parse user input
     args = parser.parse_args()
 
-    if args.voxelwise == False and args.matrix == False:
-        log.error('You need to specify an action (either/both --voxelwise or --matrix); see --help.')
+    if args.overwrite and args.update:
+        log.error('Cannot use --overwrite together with --update')
+        sys.exit()
+
+    if args.overwrite and args.resume:
+        log.error('Cannot use --overwrite together with --resume')
+        sys.exit()
+
+    if args.glm_columns is not None:
+        args.glm_columns = [c.strip() for c in args.glm_columns.split(',')]
+
+    if args.demean_runs == 'none':
+        args.demean_runs = None
+
+    if not (args.voxelwise or args.matrix or args.dynamic or args.alff or args.reho):
+        log.error('You need to specify an action (--voxelwise, --matrix, --dynamic, --alff and/or --reho); see --help.')
         sys.exit()
 
+    # local metrics to compute
+    args.local_metrics = (['alff','falff'] if args.alff else []) + (['reho'] if args.reho else [])
+
     # check that volume is file
     if args.seedvol is not None:
         for name, vol in args.seedvol:
-            file_input_type(vol)
+            if not os.path.exists(vol):
+                log.error('Seed volume cannot be found: {}'.format(vol))
+                sys.exit()
 
 
     # let's take a look at the seed argument, if available
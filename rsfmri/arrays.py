@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+
+# our imports
+from settings   import *
+from estimators import estimate
+
+#########################################
+# in-memory connectivity (no files, no subprocesses)
+#########################################
+# all analyses work on blocks of frames: (index of first frame,
+# array [voxels, frames]), as yielded by FCArrays.iter_blocks (arrays
+# in memory or memmaps) and NiftiSeries.iter_blocks (files on disk).
+
+
+# mean signal of voxels in block [frames]
+def block_timecourse(blocks):
+    return np.concatenate([block.mean(axis=0, dtype=np.float64) for _,block in blocks])
+
+
+# pearson r of timecourse with every voxel in blocks [voxels];
+# sums are accumulated block by block (one pass over the data)
+def block_correlation(blocks, ts):
+    ts = np.asarray(ts, dtype=np.float64)
+
+    sx, sxx, sxt = 0., 0., 0.
+    for start, block in blocks:
+        block = np.asarray(block, dtype=np.float64)
+        t     = ts[start:start+block.shape[1]]
+        sx   += block.sum(axis=1)
+        sxx  += (block**2).sum(axis=1)
+        sxt  += block.dot(t)
+
+    n    = len(ts)
+    cov  = sxt - sx * ts.mean()
+    varx = sxx - sx**2 / n
+    vart = ((ts - ts.mean())**2).sum()
+
+    r = np.zeros(varx.shape)
+    valid = (varx > 0) & (vart > 0)
+    r[valid] = cov[valid] / np.sqrt(varx[valid] * vart)
+    return r
+
+
+# fisher z-transform of r
+def fisher_z(r):
+    return np.arctanh(r)
+
+
+# BOLD data of one session held by the caller
+#  * bold:   [x, y, z, frames] or [voxels, frames] (e.g. already masked)
+#  * mask:   voxels to analyze (boolean, same shape as bold without frames;
+#            default all voxels); z-maps are returned for these voxels only
+#  * affine: only needed to write volumes (see to_nifti)
+# contiguous arrays (C or Fortran order, e.g. memmaps) are not copied, but
+# read block by block; other layouts (e.g. strided views) are copied once.
+class FCArrays(object):
+    def __init__(self, bold, mask=None, affine=None, block_size=32):
+        self.shape  = bold.shape[:-1]
+        self.affine = affine
+        self.block_size = block_size
+
+        if not (bold.flags.c_contiguous or bold.flags.f_contiguous):
+            bold = np.ascontiguousarray(bold)
+
+        # [voxels, frames] view (without copy) in the memory order of bold
+        self.order = 'F' if bold.flags.f_contiguous and not bold.flags.c_contiguous else 'C'
+        self.data  = bold.reshape((-1, bold.shape[-1]), order=self.order)
+
+        if mask is None:
+            mask = np.ones(self.shape, dtype=bool)
+        self.mask   = self._check_mask(mask)
+        self.voxels = self._voxels(self.mask)
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def _check_mask(self, mask):
+        mask = np.asarray(mask) > 0
+        if mask.shape != self.shape:
+            raise ValueError('mask shape {} does not match data shape {}'.format(mask.shape, self.shape))
+        return mask
+
+    def _voxels(self, mask):
+        return np.flatnonzero(mask.ravel(order=self.order))
+
+    # iterate over blocks of frames of voxels in mask (default: analysis mask)
+    #  * yields (index of first frame, array [voxels in mask, frames])
+    def iter_blocks(self, mask=None, block_size=None):
+        voxels = self.voxels if mask is None else self._voxels(self._check_mask(mask))
+        block_size = block_size or self.block_size
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            yield start, np.asarray(self.data[voxels, start:stop], dtype=np.float32)
+
+    # mean signal within seed mask [frames]
+    def timecourse(self, seed):
+        return block_timecourse(self.iter_blocks(seed))
+
+    # seeds: {name: mask}; returns DataFrame (frames x seeds)
+    def timecourses(self, seeds):
+        return pd.DataFrame({name: self.timecourse(seed) for name, seed in seeds.items()})
+
+    # connectivity matrix of seeds (see estimators); returns DataFrame (seeds x seeds)
+    def matrix(self, seeds, estimator='pearson'):
+        ts = self.timecourses(seeds)
+        fc = estimate(ts.values[np.newaxis], estimator)[0]
+        return pd.DataFrame(fc, index=ts.columns, columns=ts.columns)
+
+    # r of timecourse (e.g. of a seed, see timecourse) with every voxel in analysis mask [voxels]
+    def rmap(self, ts):
+        if len(ts) != len(self):
+            raise ValueError('timecourse has {} frames, data has {}'.format(len(ts), len(self)))
+        return block_correlation(self.iter_blocks(), ts)
+
+    # fisher z of rmap [voxels]
+    def zmap(self, ts):
+        return fisher_z(self.rmap(ts))
+
+    # values of analysis mask voxels back to a volume (3d array, or image with affine)
+    def unmask(self, values, dtype=np.float32):
+        vol = np.zeros(int(np.prod(self.shape)), dtype=dtype)
+        vol[self.voxels] = values
+        return vol.reshape(self.shape, order=self.order)
+
+    def to_nifti(self, values):
+        return nib.Nifti1Image(self.unmask(values), self.affine)
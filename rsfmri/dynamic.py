@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+import numpy as np
+
+# our imports
+from settings import *
+
+#########################################
+# dynamic (sliding-window) connectivity
+#########################################
+
+# ROI pairs stored per window (upper triangle, without diagonal)
+def roi_pairs(n):
+    return np.triu_indices(n, 1)
+
+
+# upper triangle back to square matrix
+def pairs_to_matrix(values, n):
+    m = np.eye(n)
+    i, j = roi_pairs(n)
+    m[i, j] = values
+    m[j, i] = values
+    return m
+
+
+# windowed correlations of stacked timecourses [sessions, frames, rois]
+#  * window sums are running sums: frames entering the window are added,
+#    frames leaving it are subtracted, so each window costs O(pairs * step)
+#    and only the sums of one window are kept (besides the output)
+# returns [sessions, windows, pairs] (of dtype)
+def sliding_window_corr(X, window, step=1, dtype=np.float64):
+    X = np.asarray(X, dtype=np.float64)
+    X = X - X.mean(axis=1)[:, np.newaxis, :]
+    n, T, S = X.shape
+    i, j = roi_pairs(S)
+
+    # sums of x, x^2 and pair products over frames [a, b)
+    def sums(a, b):
+        x = X[:, a:b]
+        return x.sum(axis=1), (x**2).sum(axis=1), np.matmul(x.transpose(0, 2, 1), x)[:, i, j]
+
+    starts = range(0, T - window + 1, step)
+    r = np.empty((n, len(starts), len(i)), dtype=dtype)
+
+    wx, wxx, wxy = sums(0, window)
+    for w, start in enumerate(starts):
+        if w:
+            entering = sums(start - step + window, start + window)
+            leaving  = sums(start - step, start)
+            wx, wxx, wxy = [c + a - b for c, a, b in zip((wx, wxx, wxy), entering, leaving)]
+
+        cov = wxy - wx[:, i] * wx[:, j] / window
+        var = np.maximum(wxx - wx**2 / window, 0)
+        den = np.sqrt(var[:, i] * var[:, j])
+
+        rw = np.zeros(cov.shape)
+        valid = den > 0
+        rw[valid] = cov[valid] / den[valid]
+        r[:, w] = np.clip(rw, -1, 1)
+
+    return r
+
+
+# windowed correlations of many sessions
+#  * timecourses: {session id: array (frames x rois)}
+#  * sessions with the same number of frames are computed together
+#    (in batches, to bound memory)
+# returns {session id: float16 array [windows, pairs]}
+def session_windows(timecourses, window, step=1, batch=16):
+    groups = {}
+    for session_id, ts in timecourses.items():
+        groups.setdefault(len(ts), []).append(session_id)
+
+    windows = {}
+    for frames, ids in groups.items():
+        if frames < window:
+            log.warning('{} session(s) have fewer frames ({}) than window ({}), skipping' \
+                            .format(len(ids), frames, window))
+            continue
+        for b in range(0, len(ids), batch):
+            batch_ids = ids[b:b+batch]
+            X = np.array([timecourses[sid] for sid in batch_ids])
+            for sid, r in zip(batch_ids, sliding_window_corr(X, window, step, np.float16)):
+                windows[sid] = r
+
+    return windows
+
+
+#########################################
+# connectivity states
+#########################################
+
+# k-means (k-means++ initialisation, Lloyd iterations) over rows of X
+# returns (centroids [k, features], labels [rows])
+def kmeans(X, k, n_iter=100, seed=0, chunk=4096):
+    X   = np.asarray(X, dtype=np.float32)
+    rng = np.random.RandomState(seed)
+    sq  = (X**2).sum(axis=1)
+
+    # squared distance of rows to centroids (in chunks of rows)
+    def assign(centroids):
+        csq    = (centroids**2).sum(axis=1)
+        labels = np.empty(len(X), dtype=int)
+        dist   = np.empty(len(X), dtype=np.float32)
+        for a in range(0, len(X), chunk):
+            d = sq[a:a+chunk, np.newaxis] - 2 * X[a:a+chunk].dot(centroids.T) + csq
+            labels[a:a+chunk] = d.argmin(axis=1)
+            dist[a:a+chunk]   = d.min(axis=1)
+        return labels, np.maximum(dist, 0)
+
+    # k-means++
+    centroids = X[[rng.randint(len(X))]]
+    for _ in range(1, k):
+        _, dist = assign(centroids)
+        p = dist / dist.sum() if dist.sum() > 0 else None
+        centroids = np.vstack([centroids, X[rng.choice(len(X), p=p)]])
+
+    labels = None
+    for _ in range(n_iter):
+        new_labels, _ = assign(centroids)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for c in range(k):
+            members = labels == c
+            if members.any():
+                centroids[c] = X[members].mean(axis=0)
+
+    return centroids, labels
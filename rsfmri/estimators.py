@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import numpy as np
+import pandas as pd
+
+# our imports
+from settings import *
+
+#########################################
+# connectivity matrix estimators
+#########################################
+# all estimators work on stacks of sessions: X is [sessions, frames, rois]
+# and every step is a batched array operation over the first axis.
+
+estimators = ['pearson', 'partial', 'ledoit-wolf', 'oas']
+
+
+# empirical covariance (maximum likelihood, like sklearn)
+def covariance(X):
+    Xc = X - X.mean(axis=1)[:, np.newaxis, :]
+    return Xc, np.matmul(Xc.transpose(0, 2, 1), Xc) / X.shape[1]
+
+
+# batched identity scaled by mu
+def _scaled_identity(mu, n):
+    return mu[:, np.newaxis, np.newaxis] * np.eye(n)[np.newaxis]
+
+
+# mean of diagonal
+def _trace_mean(C):
+    return np.trace(C, axis1=1, axis2=2) / C.shape[1]
+
+
+# Ledoit-Wolf shrinkage coefficient (per session)
+def ledoit_wolf_shrinkage(Xc, C):
+    n, p = Xc.shape[1:]
+    X2   = Xc**2
+    mu   = _trace_mean(C)
+
+    beta_  = np.matmul(X2.transpose(0, 2, 1), X2).sum(axis=(1, 2))
+    delta_ = (np.matmul(Xc.transpose(0, 2, 1), Xc)**2).sum(axis=(1, 2)) / n**2
+
+    beta  = (beta_ / n - delta_) / (p * n)
+    delta = (delta_ - 2 * mu * X2.sum(axis=(1, 2)) / n + p * mu**2) / p
+    beta  = np.minimum(beta, delta)
+
+    shrinkage = np.zeros(len(C))
+    valid = delta > 0
+    shrinkage[valid] = beta[valid] / delta[valid]
+    return shrinkage
+
+
+# Oracle Approximating Shrinkage coefficient (per session)
+def oas_shrinkage(Xc, C):
+    n, p  = Xc.shape[1:]
+    mu    = _trace_mean(C)
+    alpha = (C**2).mean(axis=(1, 2))
+
+    num = alpha + mu**2
+    den = (n + 1.) * (alpha - mu**2 / p)
+
+    shrinkage = np.ones(len(C))
+    valid = den != 0
+    shrinkage[valid] = np.minimum(num[valid] / den[valid], 1.)
+    return shrinkage
+
+
+def shrunk_covariance(C, shrinkage):
+    s = shrinkage[:, np.newaxis, np.newaxis]
+    return (1 - s) * C + s * _scaled_identity(_trace_mean(C), C.shape[1])
+
+
+# normalize covariance to correlation
+def cov_to_corr(C):
+    d = np.sqrt(np.diagonal(C, axis1=1, axis2=2))
+    d[d == 0] = 1
+    return C / (d[:, :, np.newaxis] * d[:, np.newaxis, :])
+
+
+# partial correlation from precision matrix
+def precision_to_partial(P):
+    R = -cov_to_corr(P)
+    idx = np.arange(P.shape[1])
+    R[:, idx, idx] = 1
+    return R
+
+
+# connectivity matrices of stacked timecourses [sessions, frames, rois]
+def estimate(X, estimator='pearson'):
+    X = np.asarray(X, dtype=np.float64)
+    Xc, C = covariance(X)
+
+    if estimator == 'pearson':
+        return cov_to_corr(C)
+    elif estimator == 'partial':
+        # rank-deficient when rois ~ frames; pseudo-inverse keeps it defined
+        return precision_to_partial(np.linalg.pinv(C))
+    elif estimator == 'ledoit-wolf':
+        S = shrunk_covariance(C, ledoit_wolf_shrinkage(Xc, C))
+        return precision_to_partial(np.linalg.inv(S))
+    elif estimator == 'oas':
+        S = shrunk_covariance(C, oas_shrinkage(Xc, C))
+        return precision_to_partial(np.linalg.inv(S))
+
+    raise ValueError('unknown matrix estimator: {}'.format(estimator))
+
+
+# connectivity matrices of many sessions
+#  * timecourses: {session id: DataFrame (frames x rois)}
+#  * sessions with the same number of frames are stacked and computed together
+# returns {session id: DataFrame (rois x rois)}
+def session_matrices(timecourses, rois, estimator='pearson'):
+    groups = {}
+    for session_id, ts in timecourses.items():
+        groups.setdefault(len(ts), []).append(session_id)
+
+    matrices = {}
+    for frames, ids in groups.items():
+        log.debug('Estimating {} matrices ({} sessions, {} frames)'.format(estimator, len(ids), frames))
+        X = np.array([timecourses[i][rois].values for i in ids])
+        for session_id, m in zip(ids, estimate(X, estimator)):
+            matrices[session_id] = pd.DataFrame(m, index=rois, columns=rois)
+
+    return matrices
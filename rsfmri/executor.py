@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+import os
+import fcntl
+import errno
+import select
+import threading
+import subprocess as sub
+from collections import deque
+
+# our imports
+from settings import *
+
+#########################################
+# external commands: one event loop (thread) runs all commands
+#########################################
+# commands are argv lists, executed without a shell; stdin can be fed
+# from a string (instead of <(...)). Output is streamed to the debug log
+# line by line; only the last lines are kept (for errors), unless the
+# output is captured. At most `limit` commands run at a time, others
+# are queued.
+
+# lines of output kept for errors
+output_tail = 20
+
+# longest partial line buffered (longer lines are logged in pieces)
+max_line = 64 * 1024
+
+
+# failed external command
+class CommandError(Exception):
+    def __init__(self, cmdstr, returncode, output=''):
+        self.cmdstr     = cmdstr
+        self.returncode = returncode
+        self.output     = output
+        Exception.__init__(self, 'command returned error {}: \"{}\"'.format(returncode, cmdstr))
+
+
+def _nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+# command submitted to executor (see CommandExecutor.submit)
+class Command(object):
+    def __init__(self, argv, stdin=None, capture=False):
+        self.argv    = [str(a) for a in argv]
+        self.stdin   = stdin
+        self.capture = capture
+        self.cmdstr  = ' '.join(self.argv)
+
+        self.proc    = None
+        self.partial = ''
+        self.tail    = deque(maxlen=output_tail)
+        self.output  = [] if capture else None
+        self.returncode = None
+        self.error   = None
+        self.done    = threading.Event()
+
+    def line(self, line):
+        log.debug('CMD OUT: {}'.format(line.rstrip()))
+        self.tail.append(line)
+
+    def feed(self, data):
+        if self.capture:
+            self.output.append(data)
+
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.line(line)
+
+        # bounded: very long lines are logged in pieces
+        while len(self.partial) > max_line:
+            self.line(self.partial[:max_line])
+            self.partial = self.partial[max_line:]
+
+    def finish(self):
+        if self.partial:
+            self.line(self.partial)
+            self.partial = ''
+
+    # wait for command; returns captured output ('' if not captured)
+    #  * raises CommandError if command fails
+    def result(self):
+        # wait with timeout: Ctrl-C is not delivered during a plain wait()
+        while not self.done.wait(1):
+            pass
+
+        if self.error is not None:
+            raise CommandError(self.cmdstr, None, str(self.error))
+        if self.returncode:
+            log.error('command returned error: \"{}\"'.format(self.cmdstr))
+            raise CommandError(self.cmdstr, self.returncode, '\n'.join(self.tail))
+
+        return ''.join(self.output) if self.capture else ''
+
+
+class CommandExecutor(object):
+    def __init__(self, limit=max_num_cmds):
+        self.limit   = limit
+        self.queue   = deque()
+        self.lock    = threading.Lock()
+        self.poll    = select.poll()
+        self.fds     = {}      # fd -> (command, 'out'/'in')
+        self.running = []
+        self.exiting = []      # output closed, process not reaped yet
+        self.failure = None    # error that stopped the loop
+
+        # wakes up loop when commands are submitted
+        self.wake_r, self.wake_w = os.pipe()
+        _nonblocking(self.wake_r)
+        self.poll.register(self.wake_r, select.POLLIN)
+
+        self.thread = threading.Thread(target=self.loop, name='command-executor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, argv, stdin=None, capture=False):
+        cmd = Command(argv, stdin, capture)
+        log.debug('COMMAND: {}'.format(cmd.cmdstr))
+        with self.lock:
+            if self.failure is not None:
+                # loop is gone, nothing would run the command
+                cmd.error = self.failure
+                cmd.done.set()
+                return cmd
+            self.queue.append(cmd)
+        os.write(self.wake_w, 'x')
+        return cmd
+
+    # run commands (all at once, within limit); raises on first failure
+    def map(self, argvs):
+        return [cmd.result() for cmd in [self.submit(argv) for argv in argvs]]
+
+    def start(self, cmd):
+        try:
+            cmd.proc = sub.Popen(cmd.argv,
+                                 stdin  = sub.PIPE if cmd.stdin is not None else open(os.devnull),
+                                 stdout = sub.PIPE,
+                                 stderr = sub.STDOUT,
+                                 close_fds = True)
+        except OSError, e:
+            # e.g. tool not found
+            log.error('could not run command: \"{}\" ({})'.format(cmd.cmdstr, e))
+            cmd.error = e
+            cmd.done.set()
+            return
+
+        out = cmd.proc.stdout.fileno()
+        _nonblocking(out)
+        self.fds[out] = (cmd, 'out')
+        self.poll.register(out, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+        if cmd.stdin is not None:
+            fd = cmd.proc.stdin.fileno()
+            _nonblocking(fd)
+            self.fds[fd] = (cmd, 'in')
+            self.poll.register(fd, select.POLLOUT | select.POLLERR)
+
+        self.running.append(cmd)
+
+    def close(self, fd):
+        self.poll.unregister(fd)
+        cmd, kind = self.fds.pop(fd)
+        (cmd.proc.stdout if kind == 'out' else cmd.proc.stdin).close()
+        return cmd, kind
+
+    def write(self, fd):
+        cmd,_ = self.fds[fd]
+        try:
+            n = os.write(fd, cmd.stdin)
+            cmd.stdin = cmd.stdin[n:]
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                cmd.stdin = ''
+        if not cmd.stdin:
+            self.close(fd)
+
+    def read(self, fd):
+        cmd,_ = self.fds[fd]
+        try:
+            data = os.read(fd, 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            data = ''
+
+        if data:
+            cmd.feed(data)
+        else:
+            # end of output
+            cmd.finish()
+            self.close(fd)
+            self.running.remove(cmd)
+            self.exiting.append(cmd)
+
+    def reap(self):
+        for cmd in list(self.exiting):
+            if cmd.proc.poll() is not None:
+                cmd.returncode = cmd.proc.returncode
+                self.exiting.remove(cmd)
+                cmd.done.set()
+
+    # event loop; if it fails, all running/queued commands fail with its
+    # error (nobody would finish them) and the error is raised
+    def loop(self):
+        try:
+            self.run_loop()
+        except Exception, e:
+            log.error('command executor failed: {}'.format(e))
+            with self.lock:
+                self.failure = e
+                pending = self.running + self.exiting + list(self.queue)
+                self.queue.clear()
+            for cmd in pending:
+                cmd.error = e
+                cmd.done.set()
+            raise
+
+    def run_loop(self):
+        while True:
+            # start queued commands
+            with self.lock:
+                while self.queue and len(self.running) + len(self.exiting) < self.limit:
+                    self.start(self.queue.popleft())
+
+            # short timeout only while processes wait to be reaped
+            timeout = 50 if self.exiting else None
+            try:
+                events = self.poll.poll(timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self.wake_r:
+                    try:
+                        os.read(self.wake_r, 4096)
+                    except OSError:
+                        pass
+                elif fd in self.fds:
+                    if self.fds[fd][1] == 'in':
+                        self.write(fd)
+                    else:
+                        self.read(fd)
+
+            self.reap()
+
+
+_executor = []
+_executor_lock = threading.Lock()
+
+# executor shared by all threads (started on first use)
+def get_executor():
+    with _executor_lock:
+        if not _executor:
+            _executor.append(CommandExecutor())
+    return _executor[0]
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import sys
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# our imports
+from settings import *
+from utils    import read_session_csv
+
+#########################################
+# group-level GLM
+#########################################
+
+# design matrix from covariate file (csv, first column is session id)
+#  * intercept + numeric columns (as is) + categorical columns
+#    (treatment coded against the first level, e.g. 'group[AD]')
+#  * columns: names of csv columns to use (default: all)
+class GroupDesign(object):
+    def __init__(self, covariates_file, columns=None):
+        df = read_session_csv(covariates_file)
+        self.covariates_file = covariates_file
+
+        if columns:
+            missing = [c for c in columns if c not in df.columns]
+            if missing:
+                log.error('Columns not found in {}: {}'.format(covariates_file, ', '.join(missing)))
+                sys.exit()
+            df = df[columns]
+
+        design = pd.DataFrame({'intercept': 1.}, index=df.index)
+        names  = ['intercept']
+        for col in df.columns:
+            if np.issubdtype(df[col].dtype, np.number):
+                design[col] = df[col].astype(float)
+                names.append(col)
+            else:
+                levels = sorted(df[col].dropna().astype(str).unique())
+                for level in levels[1:]:
+                    name = '{}[{}]'.format(col, level)
+                    design[name] = (df[col].astype(str) == level).astype(float)
+                    design.loc[df[col].isnull(), name] = np.nan
+                    names.append(name)
+
+        self.design = design[names]
+        self.names  = names
+
+    # rows of design for sessions (sessions without complete covariates are dropped)
+    def matrix(self, session_ids):
+        complete = self.design.dropna()
+        keep     = [s for s in session_ids if s in complete.index]
+        dropped  = [s for s in session_ids if s not in complete.index]
+        if dropped:
+            log.warning('{} session(s) have no (complete) covariates in {}, excluded from GLM: {}' \
+                            .format(len(dropped), self.covariates_file, ', '.join(dropped)))
+        return keep, complete.loc[keep].values
+
+    # contrast vector from 'name:column=weight,column=weight'
+    # (a bare column name is a contrast of weight 1 on that column)
+    def contrast(self, spec):
+        if ':' in spec:
+            name, terms = spec.split(':', 1)
+        else:
+            name, terms = spec, spec
+
+        c = np.zeros(len(self.names))
+        for term in terms.split(','):
+            col, _, weight = term.partition('=')
+            col = col.strip()
+            if col not in self.names:
+                log.error('Contrast \'{}\': unknown design column \'{}\' (columns: {})' \
+                            .format(spec, col, ', '.join(self.names)))
+                sys.exit()
+            c[self.names.index(col)] = float(weight) if weight else 1.
+
+        return name.replace('[','_').replace(']','').replace(' ','_'), c
+
+
+# ordinary least squares for many voxels at once; the design is factored
+# once (pseudo-inverse), every fit is then a matrix product
+class GLM(object):
+    def __init__(self, X):
+        self.X = np.asarray(X, dtype=np.float64)
+        if self.X.ndim != 2 or self.X.shape[0] == 0:
+            raise ValueError('GLM design has no rows (no sessions with covariates)')
+
+        rank = np.linalg.matrix_rank(self.X)
+        if self.X.shape[0] <= rank:
+            raise ValueError('GLM has no residual degrees of freedom ({} sessions, rank {})' \
+                                .format(self.X.shape[0], rank))
+
+        self.pinv = np.linalg.pinv(self.X)
+        self.cov  = self.pinv.dot(self.pinv.T)   # (X'X)^-1
+        self.dof  = self.X.shape[0] - rank
+
+    # Y: [sessions, voxels]; returns betas [columns, voxels], residual variance [voxels]
+    def fit(self, Y, block=65536):
+        Y = np.asarray(Y)
+        betas  = np.empty((self.X.shape[1], Y.shape[1]))
+        sigma2 = np.empty(Y.shape[1])
+        for a in range(0, Y.shape[1], block):
+            y = np.asarray(Y[:, a:a+block], dtype=np.float64)
+            b = self.pinv.dot(y)
+            betas[:, a:a+block] = b
+            sigma2[a:a+block]   = ((y - self.X.dot(b))**2).sum(axis=0) / self.dof
+        return betas, sigma2
+
+    # contrast estimate, t and (two-sided) p for each voxel
+    def contrast(self, c, betas, sigma2):
+        con = c.dot(betas)
+        se  = np.sqrt(sigma2 * c.dot(self.cov).dot(c))
+
+        t = np.zeros(con.shape)
+        valid = se > 0
+        t[valid] = con[valid] / se[valid]
+
+        p = np.ones(con.shape)
+        p[valid] = 2 * stats.t.sf(np.abs(t[valid]), self.dof)
+        return con, t, p
@@ -1,13 +1,14 @@
 #!/usr/bin/python
 
+import os
 import numpy as np
 import networkx as nx
 import tempfile
-import subprocess as sub
 import matplotlib.pyplot as plt
 from itertools import combinations
 
 # our imports
+from settings import *
 from utils import run_cmd, image_center_of_gravity
 
 #########################################
@@ -125,13 +126,7 @@ def plot_network_graph(G,
 def snapshot_overlay(underlay, overlay, out_file, vmin=.2, vmax=.7, auto_coords=False):
     # first, generate a combined volume (overlay and underlay)
     tmp_vol = tempfile.mktemp(suffix='.nii.gz')
-    cmd = 'overlay 0 0 {underlay} -a {overlay} {vmin} {vmax} {output}' \
-            .format( underlay = underlay,
-                     overlay  = overlay,
-                     vmin      = vmin,
-                     vmax      = vmax,
-                     output   = tmp_vol)
-    run_cmd(cmd)
+    run_cmd(['overlay', 0, 0, underlay, '-a', overlay, vmin, vmax, tmp_vol])
 
     # second, produce snapshot from combined volume
     if auto_coords:
@@ -141,29 +136,34 @@ def snapshot_overlay(underlay, overlay, out_file, vmin=.2, vmax=.7, auto_coords=
         tmp_x,tmp_y,tmp_z = [tempfile.mktemp(suffix='.png') for x in range(3)]
 
         # produce images
-        cmd='slicer {input} -x -{x} {tx} -y -{y} {ty} -z -{z} {tz} -t' \
-                .format(input = tmp_vol,
-                        x     = sx,
-                        tx    = tmp_x,
-                        y     = sy,
-                        ty    = tmp_y,
-                        z     = sz,
-                        tz    = tmp_z)
-        run_cmd(cmd)
+        run_cmd(['slicer', tmp_vol,
+                 '-x', '-{}'.format(sx), tmp_x,
+                 '-y', '-{}'.format(sy), tmp_y,
+                 '-z', '-{}'.format(sz), tmp_z, '-t'])
 
         # combine views into single image
         tmp_img = tempfile.mktemp(suffix='.png')
-        cmd='montage -tile 3x1 -geometry +0+0 {} {} {} {}'.format(tmp_x,tmp_y,tmp_z, tmp_img)
-        run_cmd(cmd)
+        run_cmd(['montage', '-tile', '3x1', '-geometry', '+0+0', tmp_x, tmp_y, tmp_z, tmp_img])
 
     else:
         # take axial, sagittal, coronal views at center slice
         tmp_img = tempfile.mktemp(suffix='.png')
-        cmd = 'slicer {input} -a {output} -t'.format(input=tmp_vol, output=tmp_img)
-        run_cmd(cmd)
+        run_cmd(['slicer', tmp_vol, '-a', tmp_img, '-t'])
 
     # scale the image (default is too small)
-    cmd='convert {input} -scale 300% -trim {output}'.format(input=tmp_img, output=out_file)
-    run_cmd(cmd)
+    run_cmd(['convert', tmp_img, '-scale', '300%', '-trim', out_file])
 
 
+# command (argv) to make small copy of image (e.g. for report pages);
+# None while existing copy is newer than image
+def thumbnail_cmd(src, out_file, size=thumbnail_size):
+    if os.path.isfile(out_file) and os.path.getmtime(out_file) >= os.path.getmtime(src):
+        return None
+    return ['convert', src, '-thumbnail', size, out_file]
+
+
+def thumbnail(src, out_file, size=thumbnail_size):
+    cmd = thumbnail_cmd(src, out_file, size)
+    if cmd:
+        run_cmd(cmd)
+    return out_file
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import os
+import glob
+import errno
+import json
+import time
+import threading
+import traceback
+from collections import namedtuple
+
+# our imports
+from settings import *
+from utils    import CommandError
+
+#########################################
+# task outcomes / job journal
+#########################################
+
+# result of a single task
+#  * status: 'ok', 'failed' or 'skipped' (done in an earlier run, see --resume)
+TaskOutcome = namedtuple('TaskOutcome', ['task', 'status', 'attempts', 'error', 'duration'])
+
+# errors worth another try: failed tools, and i/o errors of busy/flaky
+# (network) filesystems; programming errors and missing files fail at once
+transient_errnos = (errno.EIO, errno.ESTALE, errno.EAGAIN)
+
+def is_transient(e):
+    if isinstance(e, CommandError):
+        return True
+    return isinstance(e, EnvironmentError) and e.errno in transient_errnos
+
+
+# run func, retrying transient failures; never raises
+def run_with_retries(task, func, args=(), kwargs={}, retries=task_retries, delay=task_retry_delay):
+    start = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            func(*args, **kwargs)
+        except (Exception, SystemExit), e:
+            error = traceback.format_exc()
+            if isinstance(e, CommandError) and e.output:
+                error = '{}\n{}'.format(error, e.output)
+
+            if is_transient(e) and attempt <= retries:
+                log.warning('TASK={}, attempt {} failed ({}), retrying...'.format(task, attempt, e))
+                time.sleep(delay)
+                continue
+
+            log.error('TASK={}, failed after {} attempt(s): {}'.format(task, attempt, e))
+            return TaskOutcome(task, 'failed', attempt, error, time.time() - start)
+
+        return TaskOutcome(task, 'ok', attempt, None, time.time() - start)
+
+
+# outcomes of all tasks, one json line per outcome (latest line of a task wins)
+#  * every process writes its own file: <base>[.<suffix>].jsonl; all are read
+class JobJournal(object):
+    def __init__(self, directory, suffix=None):
+        self.directory = directory
+        name = journal_filebase if suffix is None else '{}.{}'.format(journal_filebase, suffix)
+        self.filename = os.path.join(directory, '{}.jsonl'.format(name))
+        self.lock = threading.Lock()
+
+    def record(self, outcome):
+        entry = dict(outcome._asdict(), time=time.time())
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    # latest outcome of every task (skipped tasks keep their earlier outcome)
+    def latest(self):
+        entries = []
+        for filename in glob.glob(os.path.join(self.directory, '{}*.jsonl'.format(journal_filebase))):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # partial line (interrupted run)
+                        pass
+
+        latest = {}
+        for entry in sorted(entries, key=lambda e: e['time']):
+            if entry['status'] != 'skipped':
+                latest[entry['task']] = TaskOutcome(*[entry[f] for f in TaskOutcome._fields])
+        return latest
+
+    def failures(self):
+        return sorted([o for o in self.latest().values() if o.status == 'failed'])
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+import numpy as np
+
+# our imports
+from settings import *
+
+#########################################
+# local (voxelwise) metrics: ALFF/fALFF, ReHo
+#########################################
+# all metrics work on data of voxels in a mask, [voxels, frames]; voxels
+# are processed in blocks so temporaries (spectra, ranks, neighborhood
+# gathers) stay bounded.
+
+local_metrics = ['alff', 'falff', 'reho']
+
+
+# alff (mean amplitude in band) and falff (band / total amplitude) [voxels]
+#  * one real fft per block of voxels; amplitude is sqrt of power (as REST/AFNI)
+def alff(data, tr, lo=bpss_lo, hi=bpss_hi, block_size=4096):
+    n     = data.shape[1]
+    freqs = np.fft.rfftfreq(n, tr)
+    band  = (freqs >= lo) & (freqs <= hi)
+    total = freqs > 0
+
+    a  = np.zeros(len(data))
+    fa = np.zeros(len(data))
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start+block_size], dtype=np.float64)
+        block = block - block.mean(axis=1)[:, np.newaxis]
+        amp   = np.sqrt(np.abs(np.fft.rfft(block, axis=1))**2 / n)
+
+        s_band  = amp[:, band].sum(axis=1)
+        s_total = amp[:, total].sum(axis=1)
+        a[start:start+block_size] = s_band / max(band.sum(), 1)
+
+        valid = s_total > 0
+        fa[start:start+block_size][valid] = s_band[valid] / s_total[valid]
+
+    return a, fa
+
+
+# neighborhood offsets (center included): 7 (faces), 19 (+edges), 27 (+corners)
+def neighborhood_offsets(size=27):
+    if size not in (7, 19, 27):
+        raise ValueError('neighborhood size must be 7, 19 or 27: {}'.format(size))
+
+    offsets = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                dist = abs(dx) + abs(dy) + abs(dz)
+                if (size == 7 and dist <= 1) or (size == 19 and dist <= 2) or size == 27:
+                    offsets.append((dx, dy, dz))
+    return np.array(offsets)
+
+
+# index of neighbors of every voxel in mask (in mask voxel order) [voxels, size];
+# neighbors outside of mask (or volume) are -1
+def neighbor_indices(mask, size=27):
+    index = -np.ones(mask.shape, dtype=np.int64)
+    index[mask] = np.arange(mask.sum())
+
+    coords = np.array(np.nonzero(mask)).T
+    shape  = np.array(mask.shape)
+
+    neighbors = -np.ones((len(coords), size), dtype=np.int64)
+    for j, offset in enumerate(neighborhood_offsets(size)):
+        c = coords + offset
+        inside = np.all((c >= 0) & (c < shape), axis=1)
+        neighbors[inside, j] = index[tuple(c[inside].T)]
+    return neighbors
+
+
+# ranks of each voxel's timecourse (1..frames; ties are broken by order) [voxels, frames]
+def timecourse_ranks(data, block_size=4096):
+    ranks = np.empty(data.shape, dtype=np.float32)
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start+block_size])
+        ranks[start:start+block_size] = block.argsort(axis=1).argsort(axis=1) + 1
+    return ranks
+
+
+# regional homogeneity: kendall's W of every voxel's neighborhood [voxels]
+#  * neighbors: see neighbor_indices (neighbors outside of mask are left out)
+def reho(data, neighbors, block_size=2048):
+    n = data.shape[1]
+
+    # extra row of zero ranks for missing neighbors (index -1)
+    ranks = np.vstack([timecourse_ranks(data), np.zeros((1, n), dtype=np.float32)])
+
+    w = np.zeros(len(data))
+    for start in range(0, len(data), block_size):
+        nb = neighbors[start:start+block_size]
+        k  = (nb >= 0).sum(axis=1).astype(np.float64)
+
+        # sum of ranks over neighborhood, per frame [voxels, frames]
+        rsum = ranks[nb].sum(axis=1, dtype=np.float64)
+        s    = ((rsum - (k * (n + 1) / 2.)[:, np.newaxis])**2).sum(axis=1)
+        w[start:start+block_size] = 12. * s / (k**2 * (n**3 - n))
+
+    return w
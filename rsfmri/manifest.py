@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+import os
+import json
+import errno
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from multiprocessing.pool import ThreadPool
+
+# our imports
+from settings import *
+from utils    import calc_num_threads
+
+##########################
+# session manifest
+##########################
+
+# header information of a single volume
+def read_header(filename):
+    img = nib.load(filename)
+    hdr = img.get_header()
+
+    shape = [int(x) for x in img.shape]
+    zooms = [float(x) for x in hdr.get_zooms()]
+
+    # TR (in seconds)
+    tr = zooms[3] if len(zooms) > 3 else 0.
+    if len(zooms) > 3 and hdr.get_xyzt_units()[1] == 'msec':
+        tr = tr / 1000.
+
+    st = os.stat(filename)
+    return {'file':   filename,
+            'mtime':  st.st_mtime,
+            'size':   st.st_size,
+            'shape':  shape,
+            'zooms':  zooms[:3],
+            'frames': shape[3] if len(shape) > 3 else 1,
+            'tr':     tr,
+            'affine': img.get_affine().tolist(),
+            'nbytes': int(np.prod(shape)) * 4}  # as float32
+
+
+# header information of all sessions; headers are read in parallel and
+# cached (keyed by file mtime) so repeated runs only read changed files
+class SessionManifest(object):
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.cache      = {}
+        self.sessions   = {}
+
+        if self.cache_file and os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file) as f:
+                    self.cache = json.load(f)
+            except ValueError:
+                log.warning('ignoring unreadable manifest cache: {}'.format(self.cache_file))
+
+        # reference grid
+        std = read_header(mri_standard)
+        self.std_shape  = std['shape'][:3]
+        self.std_affine = np.array(std['affine'])
+
+    def header(self, filename):
+        filename = os.path.abspath(filename)
+        entry = self.cache.get(filename)
+        if entry is not None:
+            st = os.stat(filename)
+            if entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+                return entry
+
+        entry = read_header(filename)
+        self.cache[filename] = entry
+        return entry
+
+    def build(self, sessions):
+        log.info('Reading headers of {} sessions...'.format(len(sessions)))
+
+        files = [run for session in sessions for run in session.runs]
+
+        pool = ThreadPool(processes=calc_num_threads())
+        try:
+            headers = dict(zip(files, pool.map(self.header, files)))
+        finally:
+            pool.close()
+            pool.join()
+
+        for session in sessions:
+            runs  = [headers[run] for run in session.runs]
+            entry = {'id':     session.id,
+                     'runs':   len(runs),
+                     'frames': sum(r['frames'] for r in runs),
+                     'tr':     runs[0]['tr'],
+                     'shape':  runs[0]['shape'][:3],
+                     'zooms':  runs[0]['zooms'],
+                     'size':   sum(r['size'] for r in runs),
+                     'nbytes': sum(r['nbytes'] for r in runs)}
+            entry['errors'] = self.validate(runs)
+
+            self.sessions[session.id] = entry
+            session.info = entry
+
+        self.save()
+
+    # list of problems with session's runs
+    def validate(self, runs):
+        errors = []
+        for r in runs:
+            name = os.path.basename(r['file'])
+            if len(r['shape']) != 4:
+                errors.append('{}: not a 4d volume (dims={})'.format(name, r['shape']))
+            if r['shape'][:3] != self.std_shape:
+                errors.append('{}: grid {} does not match standard {}'.format(name, r['shape'][:3], self.std_shape))
+            elif not np.allclose(r['affine'], self.std_affine, atol=1e-3):
+                errors.append('{}: affine does not match standard'.format(name))
+            if r['tr'] <= 0:
+                errors.append('{}: TR missing from header'.format(name))
+            if abs(r['tr'] - runs[0]['tr']) > 1e-3:
+                errors.append('{}: TR {} differs from first run ({})'.format(name, r['tr'], runs[0]['tr']))
+        return errors
+
+    def invalid(self):
+        return [(s, e['errors']) for s,e in sorted(self.sessions.items()) if e['errors']]
+
+    # largest session (bytes, as float32)
+    def max_nbytes(self):
+        return max([e['nbytes'] for e in self.sessions.values()] or [0])
+
+    def save(self):
+        if not self.cache_file:
+            return
+
+        # output directory of a new project (see FCProject.init_dirs)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # write then move (concurrent runs never see a partial file)
+        tmp = '{}.{}'.format(self.cache_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.cache, f)
+        os.rename(tmp, self.cache_file)
+
+    def to_csv(self, filename):
+        cols = ['runs', 'frames', 'tr', 'size', 'nbytes']
+        df = pd.DataFrame.from_dict(self.sessions, orient='index')
+        df[cols].to_csv(filename, index_label='session')
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+import os
+import fcntl
+import threading
+import numpy as np
+import nibabel as nib
+
+# our imports
+from settings import *
+
+##########################
+# masked map storage
+##########################
+
+_mask = {}
+
+# brain mask (boolean array) and affine of standard space
+def brain_mask():
+    if not _mask:
+        img = nib.load(mri_brain_mask)
+        _mask['mask']   = img.get_data() > 0
+        _mask['affine'] = img.get_affine()
+    return _mask['mask'], _mask['affine']
+
+
+# in-mask values back to a volume
+#  * values: [voxels] (3d volume) or [volumes, voxels] (4d volume)
+def unmask(values, dtype=np.float32):
+    mask, affine = brain_mask()
+    values = np.asarray(values)
+    if values.ndim == 2:
+        values = values.T
+
+    vol = np.zeros(mask.shape + values.shape[1:], dtype=dtype)
+    vol[mask] = values
+    return nib.Nifti1Image(vol, affine)
+
+
+# per-seed matrix [sessions, voxels in brain mask] of one kind of map;
+# only in-mask voxels are kept, as a contiguous float32/float16 row per
+# session, appended as sessions finish. Rows are read through a memmap.
+#  * <base>.<dtype> : raw rows
+#  * <base>.lst     : session id and row number, one per line
+#                     (last entry wins if a session is written twice)
+class MaskedStack(object):
+    def __init__(self, basename, dtype='float32'):
+        self.dtype      = np.dtype(dtype)
+        self.file_data  = '{}.{}'.format(basename, self.dtype.name)
+        self.file_index = '{}.lst'.format(basename)
+        self.file_lock  = '{}.lock'.format(basename)
+        self.nvoxels    = int(brain_mask()[0].sum())
+        self.lock       = threading.Lock()
+
+        # parsed index and memmap, kept until the files change on disk
+        self._index     = {}
+        self._index_key = None
+        self._data      = None
+        self._data_size = None
+
+    def _file_key(self, filename):
+        if not os.path.isfile(filename):
+            return None
+        st = os.stat(filename)
+        return (st.st_mtime, st.st_size)
+
+    def _read_index(self):
+        rows = {}
+        if os.path.isfile(self.file_index):
+            with open(self.file_index) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        rows[fields[0]] = int(fields[1])
+        return rows
+
+    # session id -> row (re-read only if the index file changed,
+    # e.g. rows appended by another process)
+    def index(self):
+        with self.lock:
+            key = self._file_key(self.file_index)
+            if key != self._index_key:
+                self._index, self._index_key = self._read_index(), key
+            return self._index
+
+    def sessions(self):
+        return sorted(self.index())
+
+    def __contains__(self, session_id):
+        return session_id in self.index()
+
+    def append(self, session_id, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        if values.shape != (self.nvoxels,):
+            raise ValueError('expected {} in-mask values, got {}'.format(self.nvoxels, values.shape))
+
+        # threads of this process, then other processes (spool workers)
+        with self.lock, open(self.file_lock, 'a') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                current = self._file_key(self.file_index) == self._index_key
+                # data first; the row is only visible once it is in the index
+                # (rows start at a row boundary, even after a partial write)
+                rowbytes = self.nvoxels * self.dtype.itemsize
+                mode = 'r+b' if os.path.isfile(self.file_data) else 'wb'
+                with open(self.file_data, mode) as f:
+                    f.seek(0, os.SEEK_END)
+                    row = -(-f.tell() // rowbytes)
+                    f.seek(row * rowbytes)
+                    f.write(values.tostring())
+                with open(self.file_index, 'a') as f:
+                    f.write('{} {}\n'.format(session_id, row))
+
+                # cached index only misses this row (unless others appended too)
+                if current:
+                    self._index = dict(self._index)
+                    self._index[session_id] = row
+                    self._index_key = self._file_key(self.file_index)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    # all rows (memmap; nothing is read until used)
+    #  * one memmap per store, re-created when rows were appended
+    def data(self):
+        with self.lock:
+            size = os.path.getsize(self.file_data)
+            if size != self._data_size:
+                rows = size // (self.nvoxels * self.dtype.itemsize)
+                self._data = np.memmap(self.file_data, dtype=self.dtype, mode='r', shape=(rows, self.nvoxels))
+                self._data_size = size
+            return self._data
+
+    def row(self, session_id):
+        return self.data()[self.index()[session_id]]
+
+    # rows of given sessions, in order [sessions, voxels]
+    def rows(self, session_ids):
+        index = self.index()
+        return self.data()[[index[s] for s in session_ids]]
+
+    # lossless for float32 (the maps are float32)
+    def to_nifti(self, session_id, filename):
+        nib.save(unmask(self.row(session_id)), filename)
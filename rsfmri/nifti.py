@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+import os
+import subprocess as sub
+import numpy as np
+import nibabel as nib
+from io import BytesIO
+from nibabel.fileholders import FileHolder
+from distutils.spawn import find_executable
+
+# our imports
+from settings import *
+from utils    import run_cmd
+
+# parallel gzip (falls back to gzip/zlib if not installed)
+pigz = find_executable('pigz')
+
+
+##############################
+# filenames
+##############################
+
+# filename (with extension) for volume of given artifact class
+def nifti_file(base, kind='result'):
+    return '{}.{}'.format(base, output_format[kind])
+
+
+# filename tools should write to (gzip is applied afterwards)
+def nifti_prefix(filename):
+    if filename.endswith('.gz'):
+        return filename[:-3]
+    return filename
+
+
+##############################
+# compression
+##############################
+
+# command (argv) to compress output of a tool, or None
+def compress_cmd(filename, kind='result'):
+    if not filename.endswith('.gz'):
+        return None
+
+    level = '-{}'.format(compress_level[kind])
+    if pigz is not None:
+        return [pigz, '-f', '-p', compress_threads, level, nifti_prefix(filename)]
+    return ['gzip', '-f', level, nifti_prefix(filename)]
+
+
+##############################
+# reading
+##############################
+
+# load nifti image; gzip'd files are decompressed by pigz
+# (separate read/inflate/write threads) into memory
+def load_nifti(filename):
+    if filename.endswith('.gz') and pigz is not None:
+        proc = sub.Popen([pigz, '-dc', '-p', str(compress_threads), filename],
+                         stdout = sub.PIPE)
+        data,_ = proc.communicate()
+
+        if proc.returncode == 0:
+            fobj = BytesIO(data)
+            fmap = {'header': FileHolder(fileobj=fobj),
+                    'image':  FileHolder(fileobj=fobj)}
+            return nib.Nifti1Image.from_file_map(fmap)
+
+        log.warning('pigz could not decompress {}, using zlib'.format(filename))
+
+    return nib.load(filename)
+
+
+##############################
+# writing
+##############################
+
+# compress file written by a tool (blocking)
+def compress_file(filename, kind='result'):
+    cmd = compress_cmd(filename, kind)
+    if cmd:
+        run_cmd(cmd)
+
+
+# save image in configured format
+def save_nifti(img, filename, kind='result'):
+    nib.save(img, nifti_prefix(filename))
+    compress_file(filename, kind)
+
+
+##############################
+# virtual 4d series
+##############################
+
+# presents a list of nifti files (3d or 4d) as one lazily indexed
+# series along the 4th dimension (time for runs, subjects for maps);
+# nothing is concatenated on disk.
+#  * demean: None, 'mean' (remove run mean), 'zscore' (per-run z-score)
+class NiftiSeries(object):
+    def __init__(self, files, demean=None, block_size=32):
+        self.files      = list(files)
+        self.demean     = demean
+        self.block_size = block_size
+
+        # headers only (data is read on demand)
+        self.imgs    = [nib.load(f) for f in self.files]
+        self.lengths = [img.shape[3] if len(img.shape) > 3 else 1 for img in self.imgs]
+        self.offsets = np.cumsum([0] + self.lengths)
+
+        self.shape  = self.imgs[0].shape[:3] + (int(self.offsets[-1]),)
+        self.affine = self.imgs[0].get_affine()
+        self.header = self.imgs[0].get_header()
+
+        for f, img in zip(self.files, self.imgs):
+            if img.shape[:3] != self.shape[:3]:
+                raise ValueError('volume dimensions do not match ({}): {}'.format(img.shape[:3], f))
+
+        self._stats = {}
+        self._cache = {}
+
+    def __len__(self):
+        return self.shape[3]
+
+    # run index, frame within run
+    def locate(self, index):
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('frame {} out of range'.format(index))
+        run = np.searchsorted(self.offsets, index, side='right') - 1
+        return run, index - self.offsets[run]
+
+    def __getitem__(self, index):
+        run, frame = self.locate(index)
+        return self._read(run, frame, frame+1)[..., 0]
+
+    # data of run: gzip'd runs are decompressed once (pigz, see load_nifti)
+    # and kept in memory while their blocks are read (one run at a time);
+    # uncompressed runs are sliced on disk
+    def _dataobj(self, run):
+        if not self.files[run].endswith('.gz'):
+            return self.imgs[run].dataobj
+
+        if self._cache.get('run') != run:
+            self._cache = {}  # release previous run first
+            self._cache = {'run': run, 'dataobj': load_nifti(self.files[run]).dataobj}
+        return self._cache['dataobj']
+
+    def _read(self, run, start, stop, mask=None):
+        dataobj = self._dataobj(run)
+        if len(self.imgs[run].shape) > 3:
+            data = np.asarray(dataobj[..., start:stop], dtype=np.float32)
+        else:
+            # a copy (whole uncompressed volumes are read-only memmaps)
+            data = np.array(dataobj[...], dtype=np.float32)[..., np.newaxis]
+
+        if mask is not None:
+            data = data[mask]
+
+        return self._normalize(run, data, mask)
+
+    # per-run mean/std (one streaming pass over the run, cached)
+    def _run_stats(self, run, mask):
+        # cached stats are only valid for the mask they were computed with
+        if self._stats.get('mask') is not mask:
+            self._stats = {'mask': mask}
+
+        key = run
+        if key not in self._stats:
+            n  = 0
+            s  = 0.
+            ss = 0.
+            for start in range(0, self.lengths[run], self.block_size):
+                stop = min(start + self.block_size, self.lengths[run])
+                dataobj = self._dataobj(run)
+                if len(self.imgs[run].shape) > 3:
+                    data = np.asarray(dataobj[..., start:stop], dtype=np.float64)
+                else:
+                    data = np.asarray(dataobj[...], dtype=np.float64)[..., np.newaxis]
+                if mask is not None:
+                    data = data[mask]
+                n  += data.shape[-1]
+                s  += data.sum(axis=-1)
+                ss += (data**2).sum(axis=-1)
+            mean = s / n
+            std  = np.sqrt(np.maximum(ss / n - mean**2, 0))
+            std[std == 0] = 1
+            self._stats[key] = (mean[..., np.newaxis].astype(np.float32),
+                                std[..., np.newaxis].astype(np.float32))
+        return self._stats[key]
+
+    def _normalize(self, run, data, mask):
+        if self.demean is None:
+            return data
+
+        mean, std = self._run_stats(run, mask)
+        data -= mean
+        if self.demean == 'zscore':
+            data /= std
+
+        return data
+
+    # iterate over blocks of frames (blocks never span two files)
+    #  * yields (index of first frame, array [..., frames])
+    #  * with mask, array is [voxels in mask, frames]
+    def iter_blocks(self, mask=None, block_size=None):
+        block_size = block_size or self.block_size
+        for run, length in enumerate(self.lengths):
+            for start in range(0, length, block_size):
+                stop = min(start + block_size, length)
+                yield self.offsets[run] + start, self._read(run, start, stop, mask)
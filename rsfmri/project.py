@@ -3,19 +3,34 @@
 import os
 import re
 import sys
-import tempfile
+import json
+import socket
+import threading
 import numpy as np
 import pandas as pd
+import nibabel as nib
 import matplotlib.pyplot as plt
 from shutil import copyfile
 
 # our files
 from settings import *
 from seed     import FCSeed, create_seeds_from_file
+from session  import FCSession
 from graphics import heatmap, generate_network_graph, \
                      plot_network_graph, snapshot_overlay
-from utils    import run_cmd, reset_tasks, run_cmd_parallel, \
-                     wait_for_tasks, check_file, imagez_nonzero_mean
+from utils    import reset_tasks, dispatch, run_parallel, \
+                     wait_for_tasks, check_file, imagez_nonzero_mean, calc_num_threads, \
+                     read_session_csv
+from journal  import TaskOutcome, JobJournal, run_with_retries
+from nifti    import nifti_file, save_nifti, load_nifti
+from arrays   import block_timecourse, block_correlation, fisher_z
+from local    import alff, reho, neighbor_indices
+from aggregate import SufficientStats
+from estimators import session_matrices
+from dynamic  import session_windows, pairs_to_matrix, kmeans
+from masked   import MaskedStack, brain_mask, unmask
+from glm      import GroupDesign, GLM
+from spool    import WorkSpool, run_worker
 from reports  import *
 
 
@@ -33,13 +48,8 @@ class FCSeedAnalysis(object):
         fname = '{}_{}.1d'.format(self.session.id, self.seed.name)
         self.file_ts = os.path.join(self.project.dir_ts, fname)
 
-        # rmap
-        fname = '{}_{}_pearson.nii.gz'.format(self.session.id, self.seed.name)
-        self.file_rmap = os.path.join(self.project.dir_vols, fname)
-
         # zmap
-        fname = '{}_{}_pearson_z.nii.gz'.format(self.session.id, self.seed.name)
-        self.file_zmap = os.path.join(self.project.dir_vols, fname)
+        self.file_zmap = self.project.file_zmap(self.session.id, self.seed.name)
 
         # zmap snapshot
         fname = '{}_{}_pearson_z_snapshot.png'.format(session.id, self.seed.name)
@@ -48,51 +58,47 @@ class FCSeedAnalysis(object):
         # add self to session
         self.session.add_stats(self)
 
-    def extract_ts(self):
+    def extract_ts(self, parallel=True):
         self.debug('Extracting timecourse signal')
+        return dispatch(self.extract_ts_series, parallel=parallel)
 
-        # command string
-        cmd = 'fslmeants -i {bold} -m {mask} -o {output}' \
-                .format(bold   = self.session.bold,
-                        mask   = self.seed.file,
-                        output = self.file_ts)
-
-        # returns threadpool.apply_async object
-        return run_cmd_parallel(cmd)
-
-    def fc_voxelwise(self):
-        self.debug('Computing connectivity map')
-
-        # command string
-        cmd = "3dTcorr1D -pearson -prefix {output} -mask {mask} {file3d} {ts}" \
-                  .format(output = self.file_rmap,
-                          mask   = mri_brain_mask,
-                          file3d = self.session.bold,
-                          ts     = self.file_ts)
+    def extract_ts_series(self):
+        # mean signal within seed, read block by block
+        mask = nib.load(self.seed.file).get_data() > 0
+        ts = block_timecourse(self.session.series().iter_blocks(mask))
+        np.savetxt(self.file_ts, ts, fmt='%f')
 
-        return run_cmd_parallel(cmd)
+    def fc_voxelwise(self, parallel=True):
+        self.debug('Computing connectivity z-map')
+        return dispatch(self.fc_voxelwise_series, parallel=parallel)
 
-    def fc_voxelwise_fisherz(self):
-        self.debug('Converting R to z map')
+    def fc_voxelwise_series(self):
+        # fisher z of pearson r of seed timecourse with every voxel in brain mask
+        mask,_ = brain_mask()
+        ts = np.genfromtxt(self.file_ts)
+        z  = fisher_z(block_correlation(self.session.series().iter_blocks(mask), ts))
 
-        # command string
-        cmd = "3dcalc -a {input} -expr 'log((1+a)/(1-a))/2' -prefix {output}" \
-               .format(input=self.file_rmap, output=self.file_zmap)
+        # in-mask voxels only with --masked-storage
+        self.project.save_map(self.session.id, '{}_pearson_z'.format(self.seed.name), z)
 
-        return run_cmd_parallel(cmd)
+    def has_zmap(self):
+        return self.project.has_zmap(self.session.id, self.seed)
 
     def snapshot_z(self):
         self.debug('Taking snapshot image of z map')
 
         snapshot_overlay(mri_standard, self.file_zmap, self.file_zmap_snapshot)
 
-    def run(self):
+    def run(self, voxelwise=True):
         # This runs all steps (blocking)
-        #self.extract_ts()
-        #self.fc_voxelwise()
-        #self.fc_voxelwise_fisherz()
+        self.extract_ts(parallel=False)
+        if voxelwise and not self.has_zmap():
+            self.fc_voxelwise(parallel=False)
         #self.snapshot_z()
-        pass
+
+    # name of a step in the task journal
+    def task(self, step):
+        return '{}/{}/{}'.format(self.session.id, self.seed.name, step)
 
     def debug(self, statement):
         log.debug('SESSION={}, SEED={}, {}'.format(self.session.id, self.seed.name, statement))
@@ -104,7 +110,8 @@ class FCSeedAnalysis(object):
 #########################################
 
 class FCProject(object):
-    def __init__(self, label, output_dir, input_dir, sessions):
+    def __init__(self, label, output_dir, input_dir, sessions, manifest=None, update=False,
+                 masked_storage=None, resume=False, retries=task_retries):
         # define directories
         self.dir_input    = os.path.abspath(input_dir)
         self.dir_output   = os.path.join(os.path.abspath(output_dir), label)
@@ -116,19 +123,33 @@ class FCProject(object):
         self.dir_vols     = os.path.join(self.dir_results, 'vols')
         self.dir_imgs     = os.path.join(self.dir_results, 'imgs')
         self.dir_ts       = os.path.join(self.dir_results, 'timecourse')
+        self.dir_dynamic  = os.path.join(self.dir_results, 'dynamic')
 
         # results (2nd level)
         self.dir_group    = os.path.join(self.dir_output, 'results-group')
         self.dir_grp_csv  = os.path.join(self.dir_group,  'csv')
         self.dir_grp_vols = os.path.join(self.dir_group,  'vols')
         self.dir_grp_imgs = os.path.join(self.dir_group,  'imgs')
+        self.dir_grp_stats = os.path.join(self.dir_group, 'stats')
 
         # inside /vols
         self.dir_grp_vols_mean  = os.path.join(self.dir_grp_vols,  'zmean')
         self.dir_grp_vols_ttest = os.path.join(self.dir_grp_vols,  'ttest')
+        self.dir_grp_vols_glm   = os.path.join(self.dir_grp_vols,  'glm')
 
         # initialize
         self.sessions = sessions
+        self.manifest = manifest
+        self.update   = update  # re-use existing results (only new sessions/seeds are run)
+        self.masked_storage = masked_storage  # None, 'float32' or 'float16'
+        self.resume   = resume  # re-run only failed/missing tasks of the journal
+        self.retries  = retries # attempts after a transient failure
+        self.journal  = JobJournal(self.dir_output)
+        self.outcomes = {}      # task -> outcome (this run)
+        self.completed = set()  # tasks done in earlier runs (see --resume)
+        self.failed_before = set()
+        self.map_stores = {}
+        self.map_stores_lock = threading.Lock()
         self.label    = label
         self.seeds = []
         self.seed_stats = []
@@ -137,10 +158,12 @@ class FCProject(object):
         self.report = FCReport(label)
         self.report_summary = FCReportGroupSummary()
         self.report_seeds = FCReportGroupSeeds()
+        self.report_failures = FCReportFailures()
 
         # add report groups to main report
         self.report.add_report(self.report_summary)
         self.report.add_report(self.report_seeds)
+        self.report.add_report(self.report_failures)
 
 
     def setup(self):
@@ -155,44 +178,47 @@ class FCProject(object):
         # setup sessions
         self.init_sessions()
 
+        # tasks done by earlier runs
+        if self.resume:
+            self.init_resume()
+
 
     def init_dirs(self): # create directories
         try:
             os.makedirs(self.dir_output)
         except OSError, e:
-            if e.errno ==17:
+            if e.errno ==17 and self.resume:
+                log.info('Resuming in existing results directory: %s', self.dir_output)
+            elif e.errno ==17 and self.update:
+                log.info('Updating existing results directory: %s', self.dir_output)
+            elif e.errno ==17:
                 log.error('Results directory already exists: %s', self.dir_output)
+                self.exit()
             else:
                 log.error('Could not create results directory: %s', self.dir_output)
-            self.exit()
-
-        try:
-            # create child dirs in output dir
-            os.makedirs(self.dir_results)
-            os.makedirs(self.dir_sessions)
-
-            # these are all in results dir
-            os.makedirs(self.dir_seeds)
-            os.makedirs(self.dir_vols)
-            os.makedirs(self.dir_imgs)
-            os.makedirs(self.dir_ts)
-
-            os.makedirs(self.dir_group)
-            os.makedirs(self.dir_grp_csv)
-            os.makedirs(self.dir_grp_imgs)
-            os.makedirs(self.dir_grp_vols)
-
-            # inside results-group/vols
-            os.makedirs(self.dir_grp_vols_mean)
-            os.makedirs(self.dir_grp_vols_ttest)
-        except:
-            # if they already exist, big woop!
-            pass
-
-
-    def init_log(self, log_level=logging.DEBUG):
+                self.exit()
+
+        # create child dirs in output dir
+        dirs = [self.dir_results, self.dir_sessions,
+                # these are all in results dir
+                self.dir_seeds, self.dir_vols, self.dir_imgs, self.dir_ts,
+                self.dir_dynamic,
+                self.dir_group, self.dir_grp_csv, self.dir_grp_imgs,
+                self.dir_grp_vols, self.dir_grp_stats,
+                # inside results-group/vols
+                self.dir_grp_vols_mean, self.dir_grp_vols_ttest, self.dir_grp_vols_glm]
+
+        for d in dirs:
+            try:
+                os.makedirs(d)
+            except:
+                # if they already exist, big woop!
+                pass
+
+
+    def init_log(self, log_level=logging.DEBUG, filebase=log_filebase):
         # log file
-        self.log_file = os.path.join(self.dir_output, log_filebase)
+        self.log_file = os.path.join(self.dir_output, filebase)
         log_handler  = logging.FileHandler(self.log_file)
         log_handler.setLevel(log_level)
 
@@ -210,17 +236,149 @@ class FCProject(object):
 
         for session in self.sessions:
             # soft-links to input session directory
-            os.symlink(os.path.join(self.dir_input, session.id),
-                       os.path.join(self.dir_sessions, session.id))
+            link = os.path.join(self.dir_sessions, session.id)
+            if not os.path.lexists(link):
+                os.symlink(os.path.join(self.dir_input, session.id), link)
             # write session id to file
             f.write('{}{}'.format(session.id, os.linesep))
 
         f.close()
 
+        # header info of sessions
+        if self.manifest is not None:
+            self.manifest.to_csv(os.path.join(self.dir_output, 'sessions_manifest.csv'))
+
+
+    # successful session tasks of earlier runs are skipped; group
+    # tasks always run again (sums are updated incrementally)
+    def init_resume(self):
+        latest = self.journal.latest()
+        self.completed = set(t for t,o in latest.items()
+                                if o.status == 'ok' and not t.startswith('group/'))
+        self.failed_before = set(t for t,o in latest.items() if o.status == 'failed')
+        log.info('Resuming: {} task(s) done, {} failed task(s) to re-run' \
+                    .format(len(self.completed), len(self.failed_before)))
+
+
+    # session analyses, largest sessions first (keeps the pool busy at the end)
+    def scheduled_stats(self):
+        size = lambda s: s.session.info['nbytes'] if s.session.info else 0
+        return sorted(self.seed_stats, key=size, reverse=True)
+
+    # session/seed analyses without a z-map (existing z-maps are
+    # re-used when updating results; see fc_voxelwise_groupstats)
+    def pending_stats(self):
+        return [s for s in self.scheduled_stats() if not self.has_result(s)]
+
+    # z-map of a session/seed analysis (may be partial if its task failed)
+    def has_result(self, stats):
+        failed = self.failed_latest
+        return stats.has_zmap() and not (failed(stats.task('voxelwise')) or failed(stats.task('run')))
+
+    # sessions with timecourses of all seeds (failed/missing ones are left
+    # out of group steps that read timecourses)
+    def timecourse_sessions(self):
+        failed = self.failed_latest
+        valid = [s for s in self.sessions
+                    if all(os.path.isfile(st.file_ts) and not
+                           (failed(st.task('timecourse')) or failed(st.task('run'))) for st in s.stats)]
+        skipped = [s.id for s in self.sessions if s not in valid]
+        if skipped:
+            log.warning('{} session(s) have missing/failed timecourses, left out: {}' \
+                            .format(len(skipped), ', '.join(skipped)))
+        return valid
+
+    def session(self, session_id):
+        return [s for s in self.sessions if s.id == session_id][0]
+
+    # file locations
+    # per-session maps (z-maps of seeds, local metrics), by name of map
+    def file_map(self, session_id, name):
+        fname = '{}_{}'.format(session_id, name)
+        return nifti_file(os.path.join(self.dir_vols, fname), 'result')
+
+    # matrix of masked maps, one per kind of map (see --masked-storage)
+    #  * one store per name, shared by all task threads
+    def map_store(self, name):
+        with self.map_stores_lock:
+            if name not in self.map_stores:
+                basename = os.path.join(self.dir_vols, name)
+                self.map_stores[name] = MaskedStack(basename, self.masked_storage)
+            return self.map_stores[name]
+
+    def has_map(self, session_id, name):
+        if self.masked_storage and session_id in self.map_store(name):
+            return True
+        return os.path.isfile(self.file_map(session_id, name))
+
+    # brain voxels of a session's map (None if not available);
+    # masked storage is read through a memmap
+    def load_map(self, session_id, name):
+        if self.masked_storage and session_id in self.map_store(name):
+            return np.asarray(self.map_store(name).row(session_id), dtype=np.float64)
+
+        filename = self.file_map(session_id, name)
+        if not os.path.isfile(filename):
+            return None
+        return load_nifti(filename).get_data()[brain_mask()[0]]
+
+    # identifies the current values of a session's map (changes when the
+    # map is written again; see SufficientStats.update)
+    def map_stamp(self, session_id, name):
+        if self.masked_storage and session_id in self.map_store(name):
+            return 'row:{}'.format(self.map_store(name).index()[session_id])
+        filename = self.file_map(session_id, name)
+        if os.path.isfile(filename):
+            st = os.stat(filename)
+            return 'file:{!r}:{}'.format(st.st_mtime, st.st_size)
+        return None
+
+    # update group sums of a kind of map; recomputed maps replace their
+    # earlier values (masked storage keeps earlier rows; nifti files are
+    # overwritten, so the sums are rebuilt)
+    def update_map_stats(self, stats, session_ids, name):
+        def load_removed(session_id):
+            stamp = stats.stamps.get(session_id)
+            if self.masked_storage and stamp is not None and stamp.startswith('row:'):
+                return np.asarray(self.map_store(name).data()[int(stamp[len('row:'):])], dtype=np.float64)
+            if stamp is not None and stamp != self.map_stamp(session_id, name):
+                return None
+            return self.load_map(session_id, name)
+
+        return stats.update(session_ids, lambda s: self.load_map(s, name), load_removed,
+                            lambda s: self.map_stamp(s, name))
+
+    # brain voxels of a session's map to masked storage or nifti
+    def save_map(self, session_id, name, values):
+        if self.masked_storage:
+            self.map_store(name).append(session_id, values)
+        else:
+            save_nifti(unmask(values), self.file_map(session_id, name))
+
+    def file_zmap(self, session_id, seed_name):
+        return self.file_map(session_id, '{}_pearson_z'.format(seed_name))
+
+    def zmap_store(self, seed):
+        return self.map_store('{}_pearson_z'.format(seed.name))
+
+    def has_zmap(self, session_id, seed):
+        return self.has_map(session_id, '{}_pearson_z'.format(seed.name))
+
+    def load_zmap(self, session_id, seed):
+        return self.load_map(session_id, '{}_pearson_z'.format(seed.name))
+
+    def zmap_stats(self, seed):
+        filename = os.path.join(self.dir_grp_stats, '{}_z.npz'.format(seed.name))
+        return SufficientStats(filename)
+
+    # memory needed by a single task (largest session, in bytes)
+    def task_memory(self):
+        if self.manifest is None:
+            return None
+        return self.manifest.max_nbytes()
 
-    def add_seed(self, seed):
-        self.seeds.append(seed)
 
+    def add_seed(self, seed):
         log.info('Adding seed {} to project...'.format(seed.name))
 
         # check to see if roi has useful data
@@ -228,9 +386,7 @@ class FCProject(object):
             log.error('Seed volume does not contain any values > 1')
             self.exit()
 
-        # create analysis procedures for seed
-        for session in self.sessions:
-            self.seed_stats.append( FCSeedAnalysis(self, session, seed) )
+        self.register_seed(seed)
 
         # report (snapshots of seed volume)
         snap_img = os.path.join(self.dir_seeds,
@@ -243,6 +399,25 @@ class FCProject(object):
                                   'Seed volume, file={}'.format(seed.file))
 
 
+    # create analysis procedures for seed (no checks/images; see add_seed)
+    def register_seed(self, seed):
+        self.seeds.append(seed)
+
+        for session in self.sessions:
+            self.seed_stats.append( FCSeedAnalysis(self, session, seed) )
+
+        # masked z-maps are appended from worker threads (one store per seed)
+        if self.masked_storage:
+            self.zmap_store(seed)
+
+    def seed(self, name):
+        return [s for s in self.seeds if s.name == name][0]
+
+    def seed_analysis(self, session_id, seed_name):
+        return [s for s in self.seed_stats
+                  if s.session.id == session_id and s.seed.name == seed_name][0]
+
+
     def create_seeds_from_file(self, list_file, radius=None):
         seeds = create_seeds_from_file(self.dir_seeds, list_file, radius)
         for seed in seeds: self.add_seed(seed)
@@ -265,28 +440,106 @@ class FCProject(object):
             f.close()
 
 
+    #########################################
+    # tasks (failures are isolated and journaled)
+    #########################################
+
+    # run a task with retries; the outcome is returned, errors are not raised
+    def run_task(self, task, func, *args):
+        if task in self.completed:
+            log.debug('TASK={}, done in earlier run, skipping'.format(task))
+            outcome = TaskOutcome(task, 'skipped', 0, None, 0.)
+        else:
+            outcome = run_with_retries(task, func, args, retries=self.retries)
+            self.journal.record(outcome)
+        self.outcomes[task] = outcome
+        return outcome
+
+    # run a task in thread
+    def submit(self, task, func, *args):
+        return run_parallel(self.run_task, task, func, *args)
+
+    # task failed in this run
+    def failed(self, task):
+        return task in self.outcomes and self.outcomes[task].status == 'failed'
+
+    # task failed in this run, or in an earlier run and not run since
+    def failed_latest(self, task):
+        return self.failed(task) or (task in self.failed_before and task not in self.outcomes)
+
+    # failed tasks (this or earlier runs) that have not succeeded since
+    def failures(self):
+        return self.journal.failures()
+
+
     def extract_timecourse(self):
         log.info('Extracting timecourse signal for all seeds for all users...')
-        reset_tasks()
-        for stats in self.seed_stats:
-            stats.extract_ts()
+        reset_tasks(self.task_memory())
+        for stats in self.scheduled_stats():
+            # timecourse is re-used when updating results
+            if self.update and os.path.isfile(stats.file_ts):
+                continue
+            self.submit(stats.task('timecourse'), stats.extract_ts, False)
         wait_for_tasks()
 
 
-    def fc_matrix_groupstats(self):
-        # find mean/std across all matrices
-        pearson_all = pd.Panel({s.id:s.fcmatrix() for s in self.sessions})
-        pearson_mean = pearson_all.mean(axis='items')
+    def fc_matrix_groupstats(self, estimator='pearson'):
+        seeds = sorted(seed.name for seed in self.seeds)
+
+        # per-seed csv files (row-per-session, columns are target seeds)
+        csv_file = lambda name: os.path.join(self.dir_grp_csv, 'fc_{}_{}.csv'.format(estimator, name))
+        rows = {}
+        for name in seeds:
+            if os.path.isfile(csv_file(name)):
+                rows[name] = read_session_csv(csv_file(name))
+            else:
+                rows[name] = pd.DataFrame(columns=seeds)
+
+        # values of previous sessions are read back from the per-seed files
+        def load_removed(session_id):
+            if any(session_id not in rows[name].index for name in seeds):
+                return None
+            return np.array([rows[name].loc[session_id, seeds].values for name in seeds], dtype=float)
+
+        stats = SufficientStats(os.path.join(self.dir_grp_stats, 'fc_{}.npz'.format(estimator)), key=seeds)
+
+        # matrices of new sessions (computed together, batched across sessions)
+        log.info('Computing {} matrices...'.format(estimator))
+        sessions = self.timecourse_sessions()
+        timecourses = dict((s.id, s.timecourse()) for s in sessions if s.id not in stats)
+        new = session_matrices(timecourses, seeds, estimator)
+
+        def load_current(session_id):
+            if session_id not in new:
+                # stats were rebuilt
+                new.update(session_matrices({session_id: self.session(session_id).timecourse()}, seeds, estimator))
+            return new[session_id].values
+
+        # timecourses identify the values of a session (re-extracted
+        # timecourses replace the session's matrix)
+        stamps = dict((s.id, 'ts:{!r}'.format(max(os.path.getmtime(st.file_ts) for st in s.stats)))
+                        for s in sessions)
+
+        # update sums (only new/removed/replaced sessions are read)
+        added, removed = stats.update([s.id for s in sessions], load_current, load_removed, stamps.get)
+        stats.save()
+        log.info('Matrix group stats: {} sessions ({} added, {} removed)'.format(stats.n, len(added), len(removed)))
+
+        if not stats.n:
+            log.warning('No sessions with timecourses, no group matrix')
+            return
 
         # output csv (mean)
-        outfile = os.path.join(self.dir_grp_csv, 'fc_pearson_group_mean.csv')
-        pearson_mean.to_csv(outfile)
+        fc_mean = pd.DataFrame(stats.mean(), index=seeds, columns=seeds)
+        outfile = os.path.join(self.dir_grp_csv, 'fc_{}_group_mean.csv'.format(estimator))
+        fc_mean.to_csv(outfile)
 
         # output csv per seed
-        for seed in self.seeds:
-            # file will contain row-per-session, and columns will be target seeds
-            outfile = os.path.join(self.dir_grp_csv, 'fc_pearson_{}.csv'.format(seed.name))
-            pearson_all.major_xs(seed.name).T.to_csv(outfile)
+        for i, name in enumerate(seeds):
+            keep = [sid for sid in rows[name].index if sid in stats and sid not in added]
+            df   = rows[name].reindex(index=keep, columns=seeds)
+            add  = pd.DataFrame([new[sid].values[i] for sid in added], index=added, columns=seeds)
+            pd.concat([df, add]).to_csv(csv_file(name))
 
         ################
         ### GRAPHICS ###
@@ -295,29 +548,29 @@ class FCProject(object):
         ### heatmap ####
 
         # image filename
-        outfile = os.path.join(self.dir_grp_imgs, 'fc_pearson_group_mean_heatmap.png')
+        outfile = os.path.join(self.dir_grp_imgs, 'fc_{}_group_mean_heatmap.png'.format(estimator))
 
         # remove self-correlation values (to fix scale)
-        p_fix = pearson_mean.values
-        p_fix[np.where(np.identity(pearson_mean.shape[0]))] = 0
+        p_fix = fc_mean.values
+        p_fix[np.where(np.identity(fc_mean.shape[0]))] = 0
 
         # create, save figure
-        fig = heatmap(p_fix, limits=[0,np.nanmax(p_fix)], labels=pearson_mean.index)
+        fig = heatmap(p_fix, limits=[0,np.nanmax(p_fix)], labels=fc_mean.index)
         plt.savefig(outfile)
 
         # add to report
-        self.report_summary.add_img(outfile, 'Heatmap of Functional Connectivity')
+        self.report_summary.add_img(outfile, 'Heatmap of Functional Connectivity ({})'.format(estimator))
 
         ### network graph ####
 
         # image filename
-        outfile = os.path.join(self.dir_grp_imgs, 'fc_pearson_group_mean_network.png')
+        outfile = os.path.join(self.dir_grp_imgs, 'fc_{}_group_mean_network.png'.format(estimator))
 
         # generate network graph
         thresh = 0.1
         g = generate_network_graph(matrix = p_fix,
                                    thresh = thresh,
-                                   nodes  = pearson_mean.index)
+                                   nodes  = fc_mean.index)
         # create, save figure
         fig = plot_network_graph(g)
         plt.savefig(outfile)
@@ -326,42 +579,113 @@ class FCProject(object):
         self.report_summary.add_img(outfile, 'Network Graph (thresh >= {})'.format(thresh))
 
 
-    def fc_voxelwise(self):
-        reset_tasks()
-        log.info('Producing voxelwise maps for all seeds for all sessions')
-        for stats in self.seed_stats:
-            stats.fc_voxelwise()
-        wait_for_tasks()
+    def fc_dynamic(self, window=30, step=1, states=0):
+        seeds = sorted(seed.name for seed in self.seeds)
+        dfc_file = lambda session_id: os.path.join(self.dir_dynamic, '{}_dfc.npz'.format(session_id))
 
+        # existing results count only if made with the same window/step/seeds
+        def dfc_current(session_id):
+            if not os.path.isfile(dfc_file(session_id)):
+                return False
+            dfc = np.load(dfc_file(session_id))
+            return int(dfc['window']) == window and int(dfc['step']) == step \
+                       and list(dfc['rois']) == seeds
 
-    def fc_voxelwise_fisherz(self):
-        reset_tasks()
-        log.info('Converting r-maps to z-maps for all seeds for all sessions')
-        for stats in self.seed_stats:
-            stats.fc_voxelwise_fisherz()
+        # windowed matrices (upper triangles, float16) of sessions not yet done
+        sessions = self.timecourse_sessions()
+        todo = [s for s in sessions if not (self.update and dfc_current(s.id))]
+        log.info('Computing sliding-window connectivity (window={}, step={}) for {} sessions' \
+                    .format(window, step, len(todo)))
+        timecourses = dict((s.id, s.timecourse()[seeds].values) for s in todo)
+        windows = session_windows(timecourses, window, step)
+
+        for session_id, r in windows.items():
+            np.savez(dfc_file(session_id), r=r, rois=np.array(seeds, dtype=str),
+                     window=window, step=step)
+
+        if not states:
+            return
+
+        ################
+        ### STATES   ###
+        ################
+
+        # all windows of all sessions (fisher z)
+        for s in sessions:
+            if s.id not in windows and dfc_current(s.id):
+                windows[s.id] = np.load(dfc_file(s.id))['r']
+        ids = [i for i in sorted(windows) if len(windows[i])]
+        if sum(len(windows[i]) for i in ids) < states:
+            log.warning('Fewer windows than states ({}; sessions need at least {} frames), ' \
+                        'no connectivity states'.format(states, window))
+            return
+        X = np.vstack([np.arctanh(np.clip(windows[i].astype(np.float32), -.999, .999)) for i in ids])
+
+        log.info('Clustering {} windows into {} states'.format(len(X), states))
+        centroids, labels = kmeans(X, states)
+
+        # state of each window
+        window_sessions = np.repeat(ids, [len(windows[i]) for i in ids])
+        window_index    = np.concatenate([np.arange(len(windows[i])) for i in ids])
+        outfile = os.path.join(self.dir_grp_csv, 'dfc_states.csv')
+        pd.DataFrame({'session': window_sessions, 'window': window_index, 'state': labels}) \
+            .to_csv(outfile, index=False, columns=['session', 'window', 'state'])
+
+        # state matrices
+        for k, centroid in enumerate(centroids):
+            m = pd.DataFrame(pairs_to_matrix(np.tanh(centroid), len(seeds)), index=seeds, columns=seeds)
+            m.to_csv(os.path.join(self.dir_grp_csv, 'dfc_state{}.csv'.format(k)))
+
+            outfile = os.path.join(self.dir_grp_imgs, 'dfc_state{}_heatmap.png'.format(k))
+            p_fix = m.values
+            p_fix[np.where(np.identity(len(seeds)))] = 0
+            fig = heatmap(p_fix, limits=[0,np.nanmax(p_fix)], labels=seeds)
+            plt.savefig(outfile)
+
+            occupancy = 100. * (labels == k).mean()
+            self.report_summary.add_img(outfile, 'Connectivity state {} ({:.1f}% of windows)'.format(k, occupancy))
+
+
+    def fc_voxelwise(self):
+        reset_tasks(self.task_memory())
+        log.info('Producing voxelwise z-maps for all seeds for all sessions')
+        for stats in self.pending_stats():
+            if self.failed(stats.task('timecourse')):
+                continue
+            self.submit(stats.task('voxelwise'), stats.fc_voxelwise, False)
         wait_for_tasks()
 
+
     def fc_voxelwise_all_groupstats(self, ttest=True):
-        pool = reset_tasks()
+        reset_tasks()
         log.info('Running group-level stats for all seeds')
         for seed in self.seeds:
-            pool.apply_async(self.fc_voxelwise_groupstats, (seed,ttest,))
+            self.submit('group/{}/voxelwise'.format(seed.name), self.fc_voxelwise_groupstats, seed, ttest)
         wait_for_tasks()
 
     def fc_voxelwise_groupstats(self, seed, ttest=True):
-        zmaps = [s.file_zmap for s in self.seed_stats if s.seed == seed]
-        zmaps_str = ' '.join(zmaps)
+        sessions = [s.session.id for s in self.seed_stats if s.seed == seed and self.has_result(s)]
+
+        missing = len([s for s in self.seed_stats if s.seed == seed]) - len(sessions)
+        if missing:
+            log.warning('{} session(s) have no z-map for roi={}, not included in group stats' \
+                            .format(missing, seed.name))
 
-        # concatenate vols to temp file
-        tmp = tempfile.mktemp(suffix='.nii.gz')
-        cmd = "fslmerge -t {} {}".format(tmp, zmaps_str)
-        run_cmd(cmd)
+        # update sums (only new/removed sessions are read)
+        stats = self.zmap_stats(seed)
+        added, removed = self.update_map_stats(stats, sessions, '{}_pearson_z'.format(seed.name))
+        stats.save()
+        log.info('Voxelwise group stats, roi={}: {} sessions ({} added, {} removed)' \
+                    .format(seed.name, stats.n, len(added), len(removed)))
+
+        if not stats.n:
+            log.warning('No z-maps for roi={}, no group maps'.format(seed.name))
+            return
 
         # calculate mean z-map
         log.info('creating group mean z-map, roi={}'.format(seed.name))
-        outfile = os.path.join(self.dir_grp_vols_mean, '{}_z_mean.nii.gz'.format(seed.name))
-        cmd = "fslmaths {} -Tmean {}".format(tmp, outfile)
-        run_cmd(cmd)
+        outfile = nifti_file(os.path.join(self.dir_grp_vols_mean, '{}_z_mean'.format(seed.name)))
+        save_nifti(unmask(stats.mean()), outfile)
 
         ### graphics ###
         log.info('Generating snapshot image for results, roi={}'.format(seed.name))
@@ -370,25 +694,237 @@ class FCProject(object):
         snapshot_overlay(mri_standard, outfile, snap_img, vmin=.2, vmax=.7)
 
         # add to report
-        self.report_seeds.add_img(seed.name, snap_img,
-                                  'Group mean functional connectivity with {} (z(r) > 0.2)'.format(seed.name))
+        self.report_voxelwise_seed(seed)
 
-        # run t-test
-        if ttest:
+        # one-sample t-test (from sums; volumes are mean, t as with 3dttest++)
+        if ttest and stats.n < 2:
+            log.warning('Group t-test needs at least 2 sessions, roi={}: skipped'.format(seed.name))
+        elif ttest:
             log.info('running group t-test on z-maps, roi={}'.format(seed.name))
-            outbase = os.path.join(self.dir_grp_vols_ttest, '{}.nii.gz'.format(seed.name))
-            cmd = "3dttest++ -setA {} -prefix {} -mask {}".format(tmp, outbase, mri_brain_mask)
-            run_cmd(cmd)
+            outbase = nifti_file(os.path.join(self.dir_grp_vols_ttest, seed.name))
+            save_nifti(unmask([stats.mean(), stats.tstat()]), outbase)
+
+    def report_voxelwise_seed(self, seed):
+        snap_img = os.path.join(self.dir_grp_imgs,
+                                '{}_pearson_z_snapshot.png'.format(seed.name))
+        if os.path.isfile(snap_img):
+            self.report_seeds.add_img(seed.name, snap_img,
+                                      'Group mean functional connectivity with {} (z(r) > 0.2)'.format(seed.name))
+
+    # brain voxels of z-maps [sessions, voxels]
+    def load_zmaps(self, session_ids, seed):
+        if self.masked_storage and all(s in self.zmap_store(seed) for s in session_ids):
+            return self.zmap_store(seed).rows(session_ids)
+        return np.array([self.load_zmap(s, seed) for s in session_ids])
+
+    def fc_voxelwise_all_glm(self, covariates_file, columns=None, contrasts=None):
+        design = GroupDesign(covariates_file, columns)
+        contrasts = [design.contrast(c) for c in (contrasts or design.names)]
+
+        # design is factored once and shared by all seeds, so sessions
+        # need a z-map for every seed (as in fc_voxelwise_groupstats)
+        complete = [s.id for s in self.sessions
+                        if all(self.has_result(st) for st in s.stats if st.seed in self.seeds)]
+        missing = len(self.sessions) - len(complete)
+        if missing:
+            log.warning('{} session(s) have no z-map for every seed, not included in group GLM'.format(missing))
+
+        session_ids, X = design.matrix(complete)
+        glm = GLM(X)
+        log.info('Running group GLM ({} sessions, columns: {}; dof={})' \
+                    .format(len(session_ids), ', '.join(design.names), glm.dof))
+
+        pd.DataFrame(X, index=session_ids, columns=design.names) \
+            .to_csv(os.path.join(self.dir_grp_csv, 'glm_design.csv'))
+        pd.DataFrame([c for _,c in contrasts], index=[n for n,_ in contrasts], columns=design.names) \
+            .to_csv(os.path.join(self.dir_grp_csv, 'glm_contrasts.csv'))
+
+        for seed in self.seeds:
+            log.info('fitting group GLM on z-maps, roi={}'.format(seed.name))
+            betas, sigma2 = glm.fit(self.load_zmaps(session_ids, seed))
+
+            # one volume per design column
+            outfile = nifti_file(os.path.join(self.dir_grp_vols_glm, '{}_betas'.format(seed.name)))
+            save_nifti(unmask(betas), outfile)
+
+            # volumes are contrast estimate, t, p
+            for name, c in contrasts:
+                outfile = nifti_file(os.path.join(self.dir_grp_vols_glm, '{}_{}'.format(seed.name, name)))
+                save_nifti(unmask(glm.contrast(c, betas, sigma2)), outfile)
+
+            self.report_seeds.add_txt(seed.name, 'Group GLM ({} sessions): contrasts {}' \
+                                        .format(len(session_ids), ', '.join(n for n,_ in contrasts)))
+
+    #########################################
+    # local metrics (ALFF/fALFF, ReHo)
+    #########################################
+
+    def session_local_metrics(self, session, metrics, neighbors=None):
+        log.debug('SESSION={}, Computing local metrics: {}'.format(session.id, ', '.join(metrics)))
+
+        # brain voxels of whole series [voxels, frames], read once for all metrics
+        mask,_ = brain_mask()
+        series = session.series()
+        data = np.concatenate([block for _,block in series.iter_blocks(mask)], axis=1)
+        tr   = session.info['tr'] if session.info else float(series.header.get_zooms()[3])
+
+        values = {}
+        if 'alff' in metrics or 'falff' in metrics:
+            values['alff'], values['falff'] = alff(data, tr)
+        if 'reho' in metrics:
+            values['reho'] = reho(data, neighbors)
+
+        for metric in metrics:
+            self.save_map(session.id, metric, values[metric])
+
+    # maps of all sessions (in parallel); existing maps are re-used
+    def local_metrics(self, metrics, size=reho_neighbors):
+        reset_tasks(self.task_memory())
+        log.info('Computing local metrics ({}) for all sessions'.format(', '.join(metrics)))
+
+        # neighborhoods are the same for all sessions (standard space)
+        neighbors = neighbor_indices(brain_mask()[0], size) if 'reho' in metrics else None
+
+        # stores are created before tasks share them
+        if self.masked_storage:
+            for metric in metrics:
+                self.map_store(metric)
+
+        # largest sessions first (see scheduled_stats)
+        nbytes = lambda s: s.info['nbytes'] if s.info else 0
+        for session in sorted(self.sessions, key=nbytes, reverse=True):
+            todo = [m for m in metrics if not self.has_map(session.id, m)]
+            if todo:
+                self.submit('{}/local'.format(session.id), self.session_local_metrics,
+                            session, todo, neighbors)
+        wait_for_tasks()
+
+    def local_metrics_all_groupstats(self, metrics, ttest=True):
+        reset_tasks()
+        log.info('Running group-level stats for local metrics')
+        for metric in metrics:
+            self.submit('group/{}'.format(metric), self.local_metrics_groupstats, metric, ttest)
+        wait_for_tasks()
+
+    def local_metrics_groupstats(self, metric, ttest=True):
+        sessions = [s.id for s in self.sessions
+                        if self.has_map(s.id, metric) and not self.failed('{}/local'.format(s.id))]
+
+        # update sums (only new/removed sessions are read)
+        stats = SufficientStats(os.path.join(self.dir_grp_stats, '{}.npz'.format(metric)))
+        added, removed = self.update_map_stats(stats, sessions, metric)
+        stats.save()
+        log.info('Group stats, {}: {} sessions ({} added, {} removed)' \
+                    .format(metric, stats.n, len(added), len(removed)))
+
+        if not stats.n:
+            log.warning('No {} maps, no group maps'.format(metric))
+            return
+
+        mean = stats.mean()
+        outfile = nifti_file(os.path.join(self.dir_grp_vols_mean, '{}_mean'.format(metric)))
+        save_nifti(unmask(mean), outfile)
+
+        ### graphics ###
+        snap_img = os.path.join(self.dir_grp_imgs, '{}_snapshot.png'.format(metric))
+        vmin, vmax = np.percentile(mean, [50, 99])
+        snapshot_overlay(mri_standard, outfile, snap_img, vmin=vmin, vmax=vmax)
+        self.report_summary.add_img(snap_img, 'Group mean {} ({} sessions)'.format(metric.upper(), stats.n))
+
+        # one-sample t-test (volumes are mean, t)
+        if ttest and stats.n < 2:
+            log.warning('Group t-test needs at least 2 sessions, {}: skipped'.format(metric))
+        elif ttest:
+            outbase = nifti_file(os.path.join(self.dir_grp_vols_ttest, metric))
+            save_nifti(unmask([mean, stats.tstat()]), outbase)
+
+    #########################################
+    # work spool (multi-node)
+    #########################################
+
+    def spool(self):
+        return WorkSpool(os.path.join(self.dir_output, 'spool'))
+
+    # write project config and one task per session/seed (+ group stats per seed)
+    def fill_spool(self, spool, config, voxelwise=True, group_stats=True, ttest=False):
+        spool.create()
+
+        # everything a worker needs to rebuild the project
+        config = dict(config, sessions=[s.id for s in self.sessions],
+                              seeds=[(s.name, s.file) for s in self.seeds])
+        with open(os.path.join(spool.dir, 'project.json'), 'w') as f:
+            json.dump(config, f)
+
+        n = 0
+        for stats in self.scheduled_stats():
+            if voxelwise and self.has_result(stats):
+                continue
+            if not voxelwise and self.update and os.path.isfile(stats.file_ts):
+                continue
+            spool.add(1, '{}_{}'.format(stats.session.id, stats.seed.name),
+                      {'type': 'session', 'session': stats.session.id,
+                       'seed': stats.seed.name, 'voxelwise': voxelwise})
+            n += 1
+
+        if voxelwise and group_stats:
+            for seed in self.seeds:
+                spool.add(2, 'group_{}'.format(seed.name),
+                          {'type': 'group', 'seed': seed.name, 'ttest': ttest})
+                n += 1
+
+        log.info('Added {} tasks to spool: {}'.format(n, spool.dir))
+
+    def run_spool_task(self, task):
+        if task['type'] == 'group':
+            outcome = self.run_task('group/{}/voxelwise'.format(task['seed']), self.fc_voxelwise_groupstats,
+                                    self.seed(task['seed']), task['ttest'])
+        else:
+            stats = self.seed_analysis(task['session'], task['seed'])
+            outcome = self.run_task(stats.task('run'), stats.run, task['voxelwise'])
+
+        # spool moves task to failed/
+        if outcome.status == 'failed':
+            raise RuntimeError(outcome.error)
+
+    # pull tasks from spool until it is drained
+    def work_spool(self, spool, threads=None):
+        reset_tasks()
+        run_worker(spool, self.run_spool_task, threads=threads or calc_num_threads(self.task_memory()))
+
+        failed = spool.tasks('failed')
+        if failed:
+            log.error('{} task(s) failed (see {}): {}'.format(len(failed), spool.path('failed'), ', '.join(failed)))
+
+    # project of a spool (used by --worker processes)
+    @classmethod
+    def from_spool(cls, project_dir):
+        with open(os.path.join(project_dir, 'spool', 'project.json')) as f:
+            config = json.load(f)
+
+        sessions = [FCSession(s, config['sessdir'], fwhm=config['fwhm'], demean=config['demean_runs'])
+                        for s in config['sessions']]
+        project = cls(config['label'], config['output'], config['sessdir'], sessions,
+                      masked_storage=config['masked_storage'])
+
+        # separate log/journal per worker
+        worker = '{}.{}'.format(socket.gethostname(), os.getpid())
+        project.init_log(filebase='{}.{}'.format(log_filebase, worker))
+        project.journal = JobJournal(project.dir_output, suffix=worker)
+
+        for name, filename in config['seeds']:
+            project.register_seed(FCSeed(project.dir_seeds, name, filename))
 
-        # remove 4d file
-        os.remove(tmp)
+        return project
 
     def generate_report(self):
+        # failed tasks (not fixed by a later run)
+        for outcome in self.failures():
+            self.report_failures.add(outcome)
 
         # write to file
         log.info('Generating report...')
         report_file = os.path.join(self.dir_group, 'report.html')
-        self.report.render_to_file(report_file)
+        self.report.render_to_dir(report_file, os.path.join(self.dir_group, 'report'))
 
         log.info('*********************************************')
         log.info('* report: {}'.format(report_file))
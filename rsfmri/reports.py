@@ -1,25 +1,87 @@
 #!/usr/bin/python
 
 import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
 from jinja2 import Environment, FileSystemLoader
 
+# our imports
+from settings import *
+from graphics import thumbnail, thumbnail_cmd
+from executor import CommandError, get_executor
+
+
+# thumbnail next to full image (<image>_thumb.png)
+def thumbnail_file(src):
+    base, ext = os.path.splitext(src)
+    return '{}_thumb{}'.format(base, ext)
+
+
+# items as seen from a page in page_dir: images are linked relative to the
+# page, and shown as (lazily loaded) thumbnails
+def page_items(items, page_dir):
+    page = []
+    for item in items:
+        item = dict(item)
+        if item['type'] == 'image':
+            # full image if thumbnail cannot be made
+            thumb = item['src']
+            if os.path.isfile(item['src']):
+                try:
+                    thumb = thumbnail(item['src'], thumbnail_file(item['src']))
+                except CommandError:
+                    log.warning('Could not create thumbnail of {}'.format(item['src']))
+            item['href']  = os.path.relpath(item['src'], page_dir)
+            item['thumb'] = os.path.relpath(thumb, page_dir)
+        page.append(item)
+    return page
+
+
+# make missing/outdated thumbnails of images in items (all at once)
+def make_thumbnails(items):
+    images = set(item['src'] for item in items if item['type'] == 'image' and os.path.isfile(item['src']))
+    cmds = [get_executor().submit(cmd) for cmd in
+                [thumbnail_cmd(src, thumbnail_file(src)) for src in images] if cmd]
+    for cmd in cmds:
+        try:
+            cmd.result()
+        except CommandError:
+            # see page_items
+            pass
+
+
+# hash of items and the images they show (see FCReport.render_to_dir)
+def items_hash(items):
+    images = [item['src'] for item in items if item['type'] == 'image']
+    stat   = lambda f: [os.path.getmtime(f), os.path.getsize(f)] if os.path.isfile(f) else None
+    inputs = json.dumps([items, [stat(f) for f in images]], sort_keys=True)
+    return hashlib.sha1(inputs).hexdigest()
+
+
 # Generic report
 class FCReportBase(object):
     def __init__(self, label, template_file):
         reportsdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports')
-        env = Environment(loader=FileSystemLoader(reportsdir))
-        self.template = env.get_template(template_file)
+        self.env = Environment(loader=FileSystemLoader(reportsdir))
+        self.template = self.env.get_template(template_file)
         self.label = label
 
     def _render(self, **kwargs):
         html = self.template.render(label=self.label, **kwargs)
         return html
 
+    # pages of their own (see FCReport.render_to_dir); none by default
+    def shards(self):
+        return []
+
 
 # renders html for seed-specific images/stats
+#  * index page: one entry per seed, linking the seed's page (shard)
 class FCReportGroupSeeds(FCReportBase):
     def __init__(self):
         super(self.__class__, self).__init__('Seeds', 'seeds.html')
+        self.shard_template = self.env.get_template('seed.html')
         self.seeds = {}
 
     def add_img(self, seed, src, label):
@@ -30,8 +92,21 @@ class FCReportGroupSeeds(FCReportBase):
         self.init_seed(seed)
         self.seeds[seed].append({'type': 'text', 'text': text})
 
-    def render(self):
-        return super(self.__class__,self)._render(seeds=self.seeds)
+    def render(self, page_dir=None, shard_dir=None):
+        links = {}
+        if shard_dir is not None:
+            links = {seed: os.path.relpath(self.shard_file(shard_dir, seed), page_dir) for seed in self.seeds}
+        return super(self.__class__,self)._render(seeds=self.seeds, links=links)
+
+    def shards(self):
+        return [('seed_{}'.format(seed), self.seeds[seed], self.render_shard) for seed in sorted(self.seeds)]
+
+    def shard_file(self, shard_dir, seed):
+        return os.path.join(shard_dir, 'seed_{}.html'.format(seed))
+
+    def render_shard(self, name, page_dir):
+        seed = name[len('seed_'):]
+        return self.shard_template.render(seed=seed, items=page_items(self.seeds[seed], page_dir))
 
     def init_seed(self, seed):
         if not seed in self.seeds:
@@ -50,7 +125,21 @@ class FCReportGroupSummary(FCReportBase):
     def add_txt(self, text):
         self.items.append({'type': 'text', 'text': text})
 
-    def render(self):
+    def render(self, page_dir=None, shard_dir=None):
+        items = self.items if page_dir is None else page_items(self.items, page_dir)
+        return super(self.__class__,self)._render(items=items)
+
+
+# renders html for failed tasks (empty if there are none)
+class FCReportFailures(FCReportBase):
+    def __init__(self):
+        super(self.__class__, self).__init__('Failed Tasks', 'failures.html')
+        self.items = []
+
+    def add(self, outcome):
+        self.items.append({'task': outcome.task, 'attempts': outcome.attempts, 'error': outcome.error})
+
+    def render(self, page_dir=None, shard_dir=None):
         return super(self.__class__,self)._render(items=self.items)
 
 
@@ -63,12 +152,60 @@ class FCReport(FCReportBase):
     def add_report(self, report):
         self.reports.append(report)
 
-    def render(self):
-        reports = [x.render() for x in self.reports]
-        return super(self.__class__,self)._render(reports=reports)
+    def render(self, page_dir=None, shard_dir=None):
+        reports = [x.render(page_dir, shard_dir) for x in self.reports]
+        return super(self.__class__,self)._render(reports=reports, index=None)
 
     def render_to_file(self, filename):
         html = self.render()
         # save the results
         with open(filename, "wb") as fh: fh.write(html)
 
+    # index page (filename) plus one page per shard (e.g. seed) in shard_dir
+    #  * shards are rendered in parallel, with thumbnails of their images
+    #  * shards whose items/images did not change since the last render are kept
+    def render_to_dir(self, filename, shard_dir, threads=report_threads):
+        if not os.path.isdir(shard_dir):
+            os.makedirs(shard_dir)
+
+        hashes_file = os.path.join(shard_dir, 'hashes.json')
+        hashes = {}
+        if os.path.isfile(hashes_file):
+            with open(hashes_file) as f:
+                hashes = json.load(f)
+
+        index = os.path.relpath(filename, shard_dir)
+
+        def render_shard(shard):
+            name, items, render = shard
+            html = super(FCReport, self)._render(reports=[render(name, shard_dir)], index=index)
+            with open(os.path.join(shard_dir, '{}.html'.format(name)), "wb") as fh: fh.write(html)
+
+        # changed shards only
+        todo, current = [], {}
+        for report in self.reports:
+            for shard in report.shards():
+                name, items, _ = shard
+                current[name] = items_hash(items)
+                page = os.path.join(shard_dir, '{}.html'.format(name))
+                if hashes.get(name) != current[name] or not os.path.isfile(page):
+                    todo.append(shard)
+
+        # thumbnails of all pages are made concurrently, up front
+        make_thumbnails([item for report in self.reports if isinstance(report, FCReportGroupSummary)
+                              for item in report.items] +
+                        [item for _,items,_ in todo for item in items])
+
+        if todo:
+            pool = ThreadPool(min(threads, len(todo)))
+            pool.map(render_shard, todo)
+            pool.close()
+            pool.join()
+        log.info('Report: {} of {} page(s) rendered'.format(len(todo), len(current)))
+
+        # index (small: summary and links to shards)
+        html = self.render(os.path.dirname(filename), shard_dir)
+        with open(filename, "wb") as fh: fh.write(html)
+
+        with open(hashes_file, 'w') as f:
+            json.dump(current, f)
@@ -69,15 +69,17 @@ class FCSeed(object):
         log.info('Creating spherical seed NAME={} MNI=({},{},{}) RADIUS={}mm'.format(self.name,x,y,z,radius))
 
         self.file = os.path.join(self.dir, '%s_%dmm.nii.gz' % (self.name, radius,))
-        cmd = '3dUndump -prefix {ofile} -xyz -orient LPI -master {std} -srad {rad} <(echo \'{x} {y} {z}\')' \
-                .format(ofile = self.file,
-                        std   = mri_standard,
-                        rad   = radius,
-                        x     = x,
-                        y     = y,
-                        z     = z)
-
-        run_cmd(cmd) # blocking
+
+        # seed from earlier run (when updating results)
+        if os.path.isfile(self.file):
+            log.info('Seed file already exists, re-using: {}'.format(self.file))
+            return
+
+        # coordinates are fed through stdin
+        cmd = ['3dUndump', '-prefix', self.file, '-xyz', '-orient', 'LPI',
+               '-master', mri_standard, '-srad', radius, '/dev/stdin']
+
+        run_cmd(cmd, stdin='{} {} {}\n'.format(x, y, z)) # blocking
 
     def take_snapshot(self):
         log.info('Taking snapshot image of seed \'{}\''.format(self.name))
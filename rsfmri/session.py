@@ -7,30 +7,61 @@ import pandas as pd
 
 # our imports
 from settings import *
+from nifti    import NiftiSeries
 
 ##########################
 # session
 ##########################
 
 class FCSession(object):
-    def __init__(self, session_id, parent_dir, fwhm):
+    def __init__(self, session_id, parent_dir, fwhm, demean=None):
         self.parent_dir  = parent_dir
         self.id    = session_id
         self.dir   = os.path.join(self.parent_dir, self.id)
         self.stats = []
+        self.demean = demean
+        self.info  = None  # header info (see manifest)
 
         # bold file
         restproc_file = restproc_file_template.format(fwhm)
         self.bold  = os.path.join(self.dir, restproc_dir, restproc_file)
 
+        # list of runs (multi-run sessions)
+        runs_file = restproc_runs_template.format(fwhm)
+        self.runs_file = os.path.join(self.dir, restproc_dir, runs_file)
+
         if not os.path.isdir(self.dir):
             log.error('cannot find dir: {}'.format(self.dir))
             sys.exit()
 
-        if not os.path.isfile(self.bold):
+        if os.path.isfile(self.bold):
+            self.runs = [self.bold]
+        elif os.path.isfile(self.runs_file):
+            self.runs = self.read_runs()
+            # no single file on disk; use series()
+            self.bold = None
+        else:
             log.error('cannot find file: {}'.format(self.bold))
             sys.exit()
 
+    def read_runs(self):
+        restproc = os.path.dirname(self.runs_file)
+        with open(self.runs_file) as f:
+            runs = [os.path.join(restproc, r.strip()) for r in f if r.strip()]
+
+        for run in runs:
+            if not os.path.isfile(run):
+                log.error('cannot find file: {}'.format(run))
+                sys.exit()
+
+        return runs
+
+    # all runs as a single (virtual) 4d series
+    #  * runs are only demeaned when concatenated (a single run is used as is)
+    def series(self):
+        demean = self.demean if len(self.runs) > 1 else None
+        return NiftiSeries(self.runs, demean=demean)
+
 
     def add_stats(self, stats):
         self.stats.append(stats)
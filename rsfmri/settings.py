@@ -10,6 +10,9 @@ import logging
 # processes
 max_num_threads = 40
 
+# external commands running at a time (see executor); others are queued
+max_num_cmds = 40
+
 # standard volume
 mri_standard   = '{}/data/standard/MNI152_T1_2mm_brain.nii.gz'.format(os.environ['FSLDIR'])
 mri_brain_mask = '{}/data/standard/MNI152_T1_2mm_brain_mask.nii.gz'.format(os.environ['FSLDIR'])
@@ -24,6 +27,51 @@ restproc_dir = 'restproc'
 # (found in subject's restproc dir)
 restproc_file_template = 'rest_warp_fwhm{}.nii.gz'
 
+# multi-run sessions: list of run volumes (one per line), read as a
+# single virtual series instead of a concatenated volume
+restproc_runs_template = 'rest_warp_fwhm{}.lst'
+
+# frequency band (Hz) of bandpass filter in rsfmri_preproc (BPSS_LO/BPSS_HI);
+# also the band of ALFF/fALFF
+bpss_lo = 0.009
+bpss_hi = 0.08
+
+# neighborhood of ReHo (7, 19 or 27 voxels)
+reho_neighbors = 27
+
+# output format of volumes, per artifact class
+#  * intermediate : scratch volumes that are only read back by the analysis
+#  * result       : per-session and group-level maps that are kept
+# possible formats: 'nii' (uncompressed) or 'nii.gz' (gzip)
+output_format = {'intermediate': 'nii',
+                 'result':       'nii.gz'}
+
+# gzip compression level (1=fast ... 9=small), per artifact class
+compress_level = {'intermediate': 1,
+                  'result':       6}
+
+# threads used by pigz (block-parallel gzip; output is readable by gzip)
+compress_threads = 8
+
+# cache of session header info (stored in output dir)
+manifest_filebase = '.rsfmri_manifest.json'
+
+# work spool (multi-node runs): claims not renewed within the lease
+# (seconds) are handed out again; workers poll for tasks every few seconds
+spool_lease = 600
+spool_poll  = 10
+
+# tasks: retries of transient failures (failed commands, i/o errors),
+# seconds to wait between attempts, and journal of task outcomes
+task_retries     = 1
+task_retry_delay = 30
+journal_filebase = 'journal'
+
+# report: index page + one page per seed (rendered in parallel), with
+# thumbnails (max. width x height) made next to the full images
+report_threads = 8
+thumbnail_size = '480x320'
+
 # log properties
 log_filebase = 'analysis.log'
 log_label    = 'rsfmri_analysis'
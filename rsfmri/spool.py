@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+import os
+import json
+import time
+import errno
+import socket
+import threading
+import traceback
+
+# our imports
+from settings import *
+
+#########################################
+# work spool (shared filesystem)
+#########################################
+# tasks are json files that move between directories of the spool:
+#   pending/ -> claimed/ -> done/ (or failed/)
+# a rename is atomic (also on NFS), so exactly one worker wins a claim.
+# workers touch their claimed files (heartbeat); claims that were not
+# touched for longer than the lease are moved back to pending.
+#
+# task ids start with a stage number; a task is only handed out once
+# all tasks of earlier stages are done (e.g., group stats after maps).
+
+class WorkSpool(object):
+    states = ['pending', 'claimed', 'done', 'failed', 'tmp']
+
+    def __init__(self, spool_dir, lease=spool_lease):
+        self.dir    = spool_dir
+        self.lease  = lease
+        self.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+        # claims held by this process (kept alive by heartbeat)
+        self.claims = set()
+        self.lock   = threading.Lock()
+        self.heart  = None
+
+    def path(self, state, task_id=None):
+        if task_id is None:
+            return os.path.join(self.dir, state)
+        return os.path.join(self.dir, state, '{}.json'.format(task_id))
+
+    def create(self):
+        for state in self.states:
+            try:
+                os.makedirs(self.path(state))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def tasks(self, state):
+        return sorted(f[:-len('.json')] for f in os.listdir(self.path(state)) if f.endswith('.json'))
+
+    @staticmethod
+    def stage(task_id):
+        return int(task_id.split('_', 1)[0])
+
+    ########################
+    # coordinator
+    ########################
+
+    # write task (tmp file + rename, so workers never see partial files)
+    def add(self, stage, name, payload):
+        task_id = '{}_{}'.format(stage, name)
+
+        # outcome of an earlier run of the same task
+        for state in ['done', 'failed']:
+            if os.path.isfile(self.path(state, task_id)):
+                os.remove(self.path(state, task_id))
+
+        tmp = self.path('tmp', task_id)
+        with open(tmp, 'w') as f:
+            json.dump(payload, f)
+        os.rename(tmp, self.path('pending', task_id))
+        return task_id
+
+    # move expired claims back to pending
+    def recover_stale(self):
+        now = time.time()
+        for task_id in self.tasks('claimed'):
+            try:
+                age = now - os.path.getmtime(self.path('claimed', task_id))
+                if age > self.lease:
+                    os.rename(self.path('claimed', task_id), self.path('pending', task_id))
+                    log.warning('Task {} lease expired ({:.0f}s), returned to spool'.format(task_id, age))
+            except OSError:
+                # finished/recovered by someone else in the meantime
+                pass
+
+    def drained(self):
+        return not self.tasks('pending') and not self.tasks('claimed')
+
+    def wait(self, poll=spool_poll):
+        while not self.drained():
+            self.recover_stale()
+            time.sleep(poll)
+
+    ########################
+    # worker
+    ########################
+
+    # returns (task id, payload) or (None, None) if nothing can be claimed now
+    def claim(self):
+        pending = self.tasks('pending')
+        if not pending:
+            return None, None
+
+        # only the earliest stage is available
+        stage = min(self.stage(t) for t in pending + self.tasks('claimed'))
+        for task_id in pending:
+            if self.stage(task_id) != stage:
+                continue
+            try:
+                os.rename(self.path('pending', task_id), self.path('claimed', task_id))
+            except OSError:
+                # someone else got it
+                continue
+
+            os.utime(self.path('claimed', task_id), None)
+            with self.lock:
+                self.claims.add(task_id)
+            with open(self.path('claimed', task_id)) as f:
+                return task_id, json.load(f)
+
+        return None, None
+
+    def release(self, task_id, state, info=None):
+        with self.lock:
+            self.claims.discard(task_id)
+
+        claimed = self.path('claimed', task_id)
+        try:
+            if info is not None:
+                with open(claimed) as f:
+                    payload = json.load(f)
+                payload.update(info)
+                tmp = self.path('tmp', task_id)
+                with open(tmp, 'w') as f:
+                    json.dump(payload, f)
+                os.rename(tmp, claimed)
+            os.rename(claimed, self.path(state, task_id))
+        except (OSError, IOError):
+            log.warning('Task {} was reclaimed before it finished (lease expired)'.format(task_id))
+
+    def complete(self, task_id):
+        self.release(task_id, 'done', {'worker': self.worker})
+
+    def fail(self, task_id, error):
+        self.release(task_id, 'failed', {'worker': self.worker, 'error': error})
+
+    # keep own claims alive
+    def start_heartbeat(self):
+        def beat():
+            while True:
+                time.sleep(self.lease / 4.)
+                with self.lock:
+                    claims = list(self.claims)
+                for task_id in claims:
+                    try:
+                        os.utime(self.path('claimed', task_id), None)
+                    except OSError:
+                        pass
+
+        if self.heart is None:
+            self.heart = threading.Thread(target=beat)
+            self.heart.daemon = True
+            self.heart.start()
+
+
+# pull tasks until spool is drained
+#  * run_task(payload): executes a task (raises on failure)
+def run_worker(spool, run_task, threads=1, poll=spool_poll):
+    spool.start_heartbeat()
+
+    def loop():
+        while True:
+            task_id, payload = spool.claim()
+            if task_id is None:
+                if spool.drained():
+                    return
+                spool.recover_stale()
+                time.sleep(poll)
+                continue
+
+            log.info('WORKER={}, running task {}'.format(spool.worker, task_id))
+            try:
+                run_task(payload)
+            except BaseException, e:
+                log.error('WORKER={}, task {} failed: {}'.format(spool.worker, task_id, e))
+                spool.fail(task_id, traceback.format_exc())
+            else:
+                spool.complete(task_id)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for w in workers: w.start()
+    for w in workers: w.join()
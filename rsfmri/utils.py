@@ -1,16 +1,30 @@
 #!/usr/bin/python
 
 import sys, os
-import subprocess as sub
+import pandas as pd
 from multiprocessing.pool import ThreadPool
 from multiprocessing import cpu_count
 
 # our imports
 from .settings import *
+from .executor import CommandError, get_executor
+
+
+# available memory (in bytes)
+def calc_free_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except:
+        pass
+    return None
 
 
 # number of threads is socket * cores
-def calc_num_threads():
+#  * mem_per_task: if given, limits threads to what fits in memory
+def calc_num_threads(mem_per_task=None):
     try:
         # get number of cpus (ignore hyperthreading... just 'cus)
         cmd = 'lscpu | grep -e Socket -e Core | cut -d: -f2'
@@ -29,54 +43,50 @@ def calc_num_threads():
     except:
         use_threads = max([cpu_count()/2, 1])
 
+    free_mem = calc_free_memory()
+    if mem_per_task and free_mem:
+        use_threads = max([min([use_threads, free_mem / mem_per_task]), 1])
+
     return use_threads
 
 
 # our thread pool
-def get_task_pool():
-    return ThreadPool(processes=calc_num_threads())
+def get_task_pool(mem_per_task=None):
+    return ThreadPool(processes=calc_num_threads(mem_per_task))
 
 
 task_pool = get_task_pool()
 
 
-# run command (blocking)
-def run_cmd(cmdstr):
-    log.debug('COMMAND: {}'.format(cmdstr))
-
-    # open process
-    proc = sub.Popen(cmdstr,
-                     shell = True,
-                     executable='/bin/bash',
-                     stdout = sub.PIPE,
-                     stderr = sub.STDOUT)
-
-    # for now, we will just block all processes
-    stdout,_ = proc.communicate()
-
-    # push output to debug log
-    for line in stdout.split('\n'):
-        log.debug('CMD OUT: {}'.format(line.strip()))
-
-    if proc.poll():
-        log.error('command returned error: \"{}\"'.format(cmdstr))
-        sys.exit()
-
-    # return stdout string
-    return stdout
+# run command (blocking) on the shared executor; returns its output
+#  * cmd: argv list (run without shell), or string (run by bash)
+#  * stdin: string fed to the command's input
+#  * capture: keep output to return it (False: output is only logged,
+#             '' is returned; for tools with large output)
+#  * raises CommandError if command fails
+def run_cmd(cmd, stdin=None, capture=True):
+    if isinstance(cmd, basestring):
+        cmd = ['/bin/bash', '-c', cmd]
+    return get_executor().submit(cmd, stdin, capture).result()
 
 
 # reset thread pool
-def reset_tasks():
+def reset_tasks(mem_per_task=None):
     global task_pool
-    task_pool = get_task_pool()
+    task_pool = get_task_pool(mem_per_task)
     return task_pool
 
 
-# run command in thread
-def run_cmd_parallel(cmdstr):
-    t = task_pool.apply_async(run_cmd, (cmdstr,))
-    return t
+# run function in thread
+def run_parallel(func, *args):
+    return task_pool.apply_async(func, args)
+
+
+# run function in thread (returns apply_async object) or blocking
+def dispatch(func, args=(), parallel=True):
+    if parallel:
+        return run_parallel(func, *args)
+    return func(*args)
 
 
 # wait for all current threads to end
@@ -93,6 +103,18 @@ def check_file(file_loc):
     return file_loc
 
 
+# csv file with one row per session (session id in first column)
+#  * ids are read as written (e.g. '0012'); pandas would parse them as
+#    numbers, and ignores dtype/converters of an index_col
+def read_session_csv(filename):
+    column = pd.read_csv(filename, nrows=0).columns[0]
+    df = pd.read_csv(filename, dtype={column: str}).set_index(column)
+    # id column without header (as written by to_csv)
+    if column.startswith('Unnamed:'):
+        df.index.name = None
+    return df
+
+
 ##############################
 # imaging specific 
 ##############################
@@ -100,12 +122,11 @@ def check_file(file_loc):
 # find center of gravity of nifti image
 # (useful for finding snapshot positions)
 def image_center_of_gravity(image):
-    cmd = 'fslstats {} -C'.format(image)
-    return [int(float(x)) for x in run_cmd(cmd).strip().split(' ')]
+    out = run_cmd(['fslstats', image, '-C'])
+    return [int(float(x)) for x in out.strip().split(' ')]
 
 
 # find nonzero mean
 def imagez_nonzero_mean(image):
-    cmd = 'fslstats {} -M'.format(image)
-    return float(run_cmd(cmd).strip())
+    return float(run_cmd(['fslstats', image, '-M']).strip())
 
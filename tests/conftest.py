@@ -0,0 +1,66 @@
+import os
+import sys
+import collections
+import numpy as np
+import pytest
+
+# settings name volumes in FSLDIR (the tests do not read them)
+os.environ.setdefault('FSLDIR', '/usr/share/fsl')
+
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rsfmri import project, masked
+from rsfmri.settings import restproc_dir, restproc_file_template, fwhm
+from rsfmri.session  import FCSession
+from rsfmri.project  import FCProject
+
+
+Seed = collections.namedtuple('Seed', ['name', 'file'])
+
+seed_names = ['amy', 'pcc', 'vmpfc']
+
+
+# timecourses of a session's seeds [frames, seeds] (same for every call)
+def session_timecourses(session_id, frames=60):
+    rng = np.random.RandomState(int(session_id))
+    return rng.randn(frames, len(seed_names))
+
+
+# project with sessions (empty bold volumes) and seed timecourses on disk
+def make_project(root, session_ids, update=False, **kwargs):
+    input_dir = root.join('input')
+    sessions = []
+    for session_id in session_ids:
+        restproc = input_dir.join(session_id, restproc_dir).ensure(dir=True)
+        restproc.join(restproc_file_template.format(fwhm)).ensure()
+        sessions.append(FCSession(session_id, str(input_dir), fwhm))
+
+    p = FCProject('test', str(root.join('output')), str(input_dir), sessions, update=update, **kwargs)
+    p.init_dirs()
+    for name in seed_names:
+        p.register_seed(Seed(name, None))
+
+    for stats in p.seed_stats:
+        ts = session_timecourses(stats.session.id)[:, seed_names.index(stats.seed.name)]
+        np.savetxt(stats.file_ts, ts, fmt='%f')
+    return p
+
+
+# figures are not drawn
+@pytest.fixture
+def no_figures(monkeypatch):
+    for name in ['heatmap', 'generate_network_graph', 'plot_network_graph', 'snapshot_overlay']:
+        monkeypatch.setattr(project, name, lambda *args, **kwargs: None)
+    monkeypatch.setattr(project.plt, 'savefig', lambda *args, **kwargs: None)
+
+
+# small brain mask (instead of the standard one in FSLDIR)
+@pytest.fixture
+def small_mask(monkeypatch):
+    mask = np.zeros((4, 5, 3), dtype=bool)
+    mask[1:3, 1:4, :] = True
+    monkeypatch.setattr(masked, '_mask', {'mask': mask, 'affine': np.eye(4)})
+    return mask
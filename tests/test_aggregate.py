@@ -0,0 +1,107 @@
+import os
+import time
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import make_project, seed_names
+from rsfmri.aggregate import SufficientStats
+
+
+def values(session_id, version=0):
+    return np.random.RandomState(int(session_id) + 1000 * version).randn(6)
+
+
+def check(stats, current):
+    data = np.array([current[s] for s in sorted(current)])
+    assert sorted(stats.sessions) == sorted(current)
+    assert np.allclose(stats.mean(), data.mean(axis=0))
+    assert np.allclose(stats.std(), data.std(axis=0, ddof=1))
+    assert np.allclose(stats.tstat(), data.mean(axis=0) / (data.std(axis=0, ddof=1) / np.sqrt(len(data))))
+
+
+def test_update_and_reload(tmpdir):
+    filename = str(tmpdir.join('stats.npz'))
+    current = dict((s, values(s)) for s in ['0012', '0013', '0100'])
+    stats = SufficientStats(filename, key=['a'])
+    assert stats.update(sorted(current), current.get) == (['0012', '0013', '0100'], [])
+    stats.save()
+    check(stats, current)
+
+    # removed values are read with load_removed
+    old = dict(current)
+    del current['0013']
+    current['0200'] = values('0200')
+    stats = SufficientStats(filename, key=['a'])
+    assert stats.update(sorted(current), current.get, old.get) == (['0200'], ['0013'])
+    check(stats, current)
+
+    # other layout: rebuilt
+    stats = SufficientStats(filename, key=['b'])
+    assert stats.n == 0
+
+
+def test_recomputed_values_replace_old_ones(tmpdir):
+    filename = str(tmpdir.join('stats.npz'))
+    current = dict((s, values(s)) for s in ['0012', '0013', '0100'])
+    stamps  = dict((s, 'v0') for s in current)
+    stats = SufficientStats(filename)
+    stats.update(sorted(current), current.get, stamp=stamps.get)
+    stats.save()
+
+    # old values still available: subtracted, new ones added
+    old = dict(current)
+    current['0013'], stamps['0013'] = values('0013', 1), 'v1'
+    stats = SufficientStats(filename)
+    assert stats.update(sorted(current), current.get, old.get, stamps.get) == (['0013'], ['0013'])
+    check(stats, current)
+    stats.save()
+
+    # old values gone (default load_removed): rebuilt from current values
+    current['0100'], stamps['0100'] = values('0100', 1), 'v1'
+    stats = SufficientStats(filename)
+    added, _ = stats.update(sorted(current), current.get, stamp=stamps.get)
+    assert sorted(added) == sorted(current)
+    check(stats, current)
+
+
+def test_too_few_sessions(tmpdir):
+    stats = SufficientStats(str(tmpdir.join('stats.npz')))
+    with pytest.raises(ValueError):
+        stats.mean()
+    stats.add('0012', values('0012'))
+    assert np.allclose(stats.mean(), values('0012'))
+    with pytest.raises(ValueError):
+        stats.tstat()
+
+
+def zmap_mean(p, name):
+    return nib.load(os.path.join(p.dir_grp_vols_mean, '{}_z_mean.nii.gz'.format(name))).get_data()
+
+
+@pytest.mark.parametrize('masked_storage', [None, 'float32'])
+def test_recomputed_zmap(tmpdir, small_mask, no_figures, masked_storage):
+    sessions = ['0012', '0013', '0100']
+    p = make_project(tmpdir, sessions, masked_storage=masked_storage)
+    zmaps = dict((s, values(s)[:1].repeat(small_mask.sum())) for s in sessions)
+    for s in sessions:
+        p.save_map(s, '{}_pearson_z'.format(seed_names[0]), zmaps[s])
+    p.fc_voxelwise_groupstats(p.seeds[0])
+    expected = np.mean([zmaps[s] for s in sessions], axis=0)
+    assert np.allclose(zmap_mean(p, seed_names[0])[small_mask], expected)
+
+    # z-map of a session is written again
+    time.sleep(.01)
+    p = make_project(tmpdir, sessions, update=True, masked_storage=masked_storage)
+    zmaps['0013'] = zmaps['0013'] + 1
+    p.save_map('0013', '{}_pearson_z'.format(seed_names[0]), zmaps['0013'])
+    p.fc_voxelwise_groupstats(p.seeds[0])
+    expected = np.mean([zmaps[s] for s in sessions], axis=0)
+    assert np.allclose(zmap_mean(p, seed_names[0])[small_mask], expected)
+
+
+# no z-maps (e.g. all failed): no group maps, no error
+def test_groupstats_without_sessions(tmpdir, small_mask, no_figures):
+    p = make_project(tmpdir, ['0012'], masked_storage='float32')
+    p.fc_voxelwise_groupstats(p.seeds[0])
+    assert not os.path.isfile(os.path.join(p.dir_grp_vols_mean, '{}_z_mean.nii.gz'.format(seed_names[0])))
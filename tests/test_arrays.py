@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from rsfmri.arrays import FCArrays, block_correlation, block_timecourse
+
+
+@pytest.fixture
+def bold():
+    rng = np.random.RandomState(0)
+    return rng.randn(4, 5, 3, 40).astype(np.float32)
+
+
+def expected_rmap(bold, mask, ts):
+    return np.array([np.corrcoef(v, ts)[0, 1] for v in bold[mask]])
+
+
+@pytest.mark.parametrize('layout', ['C', 'F', 'strided'])
+def test_layouts(bold, layout):
+    mask = np.zeros(bold.shape[:3], dtype=bool)
+    mask[1:3, :, 1:] = True
+    seed = np.zeros(bold.shape[:3], dtype=bool)
+    seed[0, 0, :] = True
+
+    if layout == 'F':
+        data = np.asfortranarray(bold)
+    elif layout == 'strided':
+        data = np.zeros(bold.shape[:3] + (80,), dtype=np.float32)
+        data[..., ::2] = bold
+        data = data[..., ::2]
+    else:
+        data = bold
+
+    fc = FCArrays(data, mask, block_size=7)
+    if layout != 'strided':
+        assert np.may_share_memory(fc.data, data)
+
+    ts = fc.timecourse(seed)
+    assert np.allclose(ts, bold[seed].mean(axis=0), atol=1e-6)
+    # voxels are in memory order of data; unmask puts them back in place
+    vol = fc.unmask(fc.rmap(ts))
+    assert np.allclose(vol[mask], expected_rmap(bold, mask, ts), atol=1e-5)
+    assert (vol[~mask] == 0).all()
+
+
+def test_rmap_frames(bold):
+    with pytest.raises(ValueError):
+        FCArrays(bold).rmap(np.zeros(10))
+
+
+def test_block_correlation_constant_voxel():
+    data = np.random.RandomState(1).randn(3, 20)
+    data[1] = 2.
+    ts = data[0] + data[2]
+    r = block_correlation([(0, data[:, :8]), (8, data[:, 8:])], ts)
+    assert r[1] == 0
+    assert np.isclose(r[0], np.corrcoef(data[0], ts)[0, 1])
+    assert np.allclose(block_timecourse([(0, data[:, :8]), (8, data[:, 8:])]), data.mean(axis=0))
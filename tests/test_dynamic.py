@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_project, session_timecourses
+from rsfmri.dynamic import sliding_window_corr, session_windows, roi_pairs, pairs_to_matrix, kmeans
+
+
+def expected_windows(ts, window, step):
+    i, j = roi_pairs(ts.shape[1])
+    return np.array([np.corrcoef(ts[a:a+window].T)[i, j]
+                        for a in range(0, len(ts) - window + 1, step)])
+
+
+@pytest.mark.parametrize('window,step', [(10, 1), (10, 3), (7, 12), (60, 1)])
+def test_window_corr_matches_corrcoef(window, step):
+    X = np.random.RandomState(0).randn(3, 60, 5) * 10 + 100
+    r = sliding_window_corr(X, window, step)
+    for ts, rs in zip(X, r):
+        assert np.allclose(rs, expected_windows(ts, window, step))
+
+
+def test_window_corr_constant_roi():
+    X = np.random.RandomState(0).randn(1, 40, 3)
+    X[0, :, 1] = 5.
+    r = sliding_window_corr(X, 10)
+    # pairs 0-1 and 1-2 (columns 0, 2) include the constant roi
+    assert np.allclose(r[0, :, [0, 2]], 0)
+    assert np.allclose(r[0, :, 1], expected_windows(X[0][:, [0, 2]], 10, 1)[:, 0])
+
+
+def test_session_windows():
+    timecourses = {'0012': session_timecourses('0012'),
+                   '0013': session_timecourses('0013', frames=45),
+                   '0100': session_timecourses('0100', frames=20)}
+    windows = session_windows(timecourses, 30, 5, batch=1)
+    assert sorted(windows) == ['0012', '0013']   # 0100 is too short
+    for sid, r in windows.items():
+        assert r.dtype == np.float16
+        assert np.allclose(r, expected_windows(timecourses[sid], 30, 5), atol=1e-3)
+
+
+def test_pairs_to_matrix():
+    m = np.corrcoef(session_timecourses('0012').T)
+    i, j = roi_pairs(len(m))
+    assert np.allclose(pairs_to_matrix(m[i, j], len(m)), m)
+
+
+def test_kmeans_separates_clusters():
+    rng = np.random.RandomState(0)
+    X = np.vstack([rng.randn(50, 4) * .1 + c for c in [0, 5, 10]])
+    centroids, labels = kmeans(X, 3)
+    assert len(set(labels[:50])) == len(set(labels[50:100])) == len(set(labels[100:])) == 1
+    assert len(set(labels)) == 3
+
+
+def test_dynamic_states(tmpdir, no_figures):
+    p = make_project(tmpdir, ['0012', '0013', '0100'])
+    p.fc_dynamic(window=20, step=5, states=2)
+    states = pd.read_csv(os.path.join(p.dir_grp_csv, 'dfc_states.csv'), dtype={'session': str})
+    assert len(states) == 3 * 9
+    assert sorted(states.session.unique()) == ['0012', '0013', '0100']
+
+    # files made with another window are recomputed
+    p = make_project(tmpdir, ['0012', '0013', '0100'], update=True)
+    p.fc_dynamic(window=30, step=5, states=2)
+    dfc = np.load(os.path.join(p.dir_dynamic, '0012_dfc.npz'))
+    assert int(dfc['window']) == 30 and len(dfc['r']) == 7
+
+
+# no session has enough frames for a window: no states, no error
+def test_dynamic_without_windows(tmpdir, no_figures):
+    p = make_project(tmpdir, ['0012', '0013'])
+    p.fc_dynamic(window=100, step=1, states=2)
+    assert not os.path.isfile(os.path.join(p.dir_grp_csv, 'dfc_states.csv'))
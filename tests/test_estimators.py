@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rsfmri.estimators import estimate, session_matrices, ledoit_wolf_shrinkage, oas_shrinkage, covariance
+
+
+@pytest.fixture
+def X():
+    rng = np.random.RandomState(0)
+    mixing = rng.randn(6, 6)
+    return np.array([rng.randn(80, 6).dot(mixing) for _ in range(3)])
+
+
+def partial_from_precision(P):
+    d = np.sqrt(np.diag(P))
+    R = -P / np.outer(d, d)
+    np.fill_diagonal(R, 1)
+    return R
+
+
+def test_pearson(X):
+    for x, m in zip(X, estimate(X, 'pearson')):
+        assert np.allclose(m, np.corrcoef(x.T))
+
+
+def test_partial(X):
+    for x, m in zip(X, estimate(X, 'partial')):
+        assert np.allclose(m, partial_from_precision(np.linalg.inv(np.cov(x.T, bias=True))))
+
+
+def test_shrinkage_matches_sklearn(X):
+    covariance_ = pytest.importorskip('sklearn.covariance')
+    Xc, C = covariance(X)
+    lw  = ledoit_wolf_shrinkage(Xc, C)
+    oas = oas_shrinkage(Xc, C)
+    for k, x in enumerate(X):
+        assert np.isclose(lw[k], covariance_.LedoitWolf().fit(x).shrinkage_)
+        assert np.isclose(oas[k], covariance_.OAS().fit(x).shrinkage_)
+
+        expected = covariance_.LedoitWolf().fit(x).precision_
+        assert np.allclose(estimate(X, 'ledoit-wolf')[k], partial_from_precision(expected))
+        expected = covariance_.OAS().fit(x).precision_
+        assert np.allclose(estimate(X, 'oas')[k], partial_from_precision(expected))
+
+
+def test_unknown_estimator(X):
+    with pytest.raises(ValueError):
+        estimate(X, 'spearman')
+
+
+def test_session_matrices(X):
+    rois = ['a', 'b', 'c', 'd', 'e', 'f']
+    timecourses = {'0012': pd.DataFrame(X[0], columns=rois),
+                   '0013': pd.DataFrame(X[1][:50], columns=rois)}
+    matrices = session_matrices(timecourses, ['c', 'a'])
+    assert sorted(matrices) == ['0012', '0013']
+    assert list(matrices['0013'].index) == ['c', 'a']
+    assert np.isclose(matrices['0013'].loc['c', 'a'], np.corrcoef(X[1][:50, 2], X[1][:50, 0])[0, 1])
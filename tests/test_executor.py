@@ -0,0 +1,61 @@
+import time
+import pytest
+
+from rsfmri.executor import CommandExecutor, CommandError
+from rsfmri.utils import run_cmd
+
+
+@pytest.fixture
+def executor():
+    return CommandExecutor(limit=2)
+
+
+def test_output_and_stdin(executor):
+    data = 'x' * 300000 + '\n'
+    assert executor.submit(['cat'], stdin=data, capture=True).result() == data
+    assert executor.submit(['echo', 'hi']).result() == ''
+
+
+def test_failed_command(executor):
+    cmd = executor.submit(['/bin/bash', '-c', 'for i in $(seq 50); do echo line$i; done; exit 3'])
+    with pytest.raises(CommandError) as e:
+        cmd.result()
+    assert e.value.returncode == 3
+    lines = e.value.output.split('\n')
+    assert len(lines) == 20 and lines[-1] == 'line50'
+
+
+def test_missing_tool(executor):
+    with pytest.raises(CommandError) as e:
+        executor.submit(['no-such-tool-here']).result()
+    assert e.value.returncode is None
+
+
+def test_limit(executor):
+    start = time.time()
+    executor.map([['sleep', '0.3']] * 4)
+    assert time.time() - start >= 0.6
+
+
+# error in the event loop fails all commands instead of leaving them waiting
+def test_loop_failure(executor):
+    def broken():
+        raise RuntimeError('broken loop')
+    executor.reap = broken
+
+    queued = [executor.submit(['sleep', '0.2']) for _ in range(3)]
+    for cmd in queued:
+        with pytest.raises(CommandError) as e:
+            cmd.result()
+        assert 'broken loop' in e.value.output
+
+    # later commands fail right away
+    with pytest.raises(CommandError):
+        executor.submit(['true']).result()
+
+
+def test_run_cmd_returns_output():
+    assert run_cmd('echo a; echo b') == 'a\nb\n'
+    assert run_cmd(['echo', 'c'], capture=False) == ''
+    with pytest.raises(CommandError):
+        run_cmd('exit 1')
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import make_project, seed_names
+from rsfmri.glm import GroupDesign, GLM
+
+covariates = """session,age,group
+0012,71,AD
+0013,65,CN
+0100,80,AD
+0200,58,CN
+0300,77,CN
+0400,69,AD
+"""
+
+session_ids = ['0012', '0013', '0100', '0200', '0300', '0400']
+
+
+@pytest.fixture
+def covariates_file(tmpdir):
+    f = tmpdir.join('covariates.csv')
+    f.write(covariates)
+    return str(f)
+
+
+def test_design_keeps_zero_padded_ids(covariates_file):
+    design = GroupDesign(covariates_file)
+    keep, X = design.matrix(session_ids)
+    assert keep == session_ids
+    assert design.names == ['intercept', 'age', 'group[CN]']
+    assert np.allclose(X[:, 1], [71, 65, 80, 58, 77, 69])
+    assert np.allclose(X[:, 2], [0, 1, 0, 1, 1, 0])
+
+
+def test_glm_matches_least_squares(covariates_file):
+    _, X = GroupDesign(covariates_file).matrix(session_ids)
+    Y = np.random.RandomState(0).randn(len(X), 50)
+
+    glm = GLM(X)
+    betas, sigma2 = glm.fit(Y, block=16)
+    expected, residuals = np.linalg.lstsq(X, Y, rcond=None)[:2]
+    assert glm.dof == len(X) - 3
+    assert np.allclose(betas, expected)
+    assert np.allclose(sigma2, residuals / glm.dof)
+
+    c = np.array([0., 1., 0.])
+    con, t, p = glm.contrast(c, betas, sigma2)
+    se = np.sqrt(sigma2 * np.linalg.inv(X.T.dot(X))[1, 1])
+    assert np.allclose(con, expected[1])
+    assert np.allclose(t, expected[1] / se)
+    assert ((p > 0) & (p <= 1)).all()
+
+
+def test_glm_rejects_empty_or_saturated_design():
+    with pytest.raises(ValueError):
+        GLM(np.zeros((0, 3)))
+    with pytest.raises(ValueError):
+        GLM(np.random.RandomState(0).randn(3, 3))
+
+
+# z-maps (masked storage) of zero-padded sessions reach the GLM
+def test_project_glm(tmpdir, covariates_file, small_mask, no_figures):
+    p = make_project(tmpdir, session_ids, masked_storage='float32')
+    nvoxels = int(small_mask.sum())
+    rng = np.random.RandomState(1)
+    zmaps = {}
+    for session_id in session_ids:
+        for name in seed_names:
+            zmaps[session_id, name] = rng.randn(nvoxels).astype(np.float32)
+            p.save_map(session_id, '{}_pearson_z'.format(name), zmaps[session_id, name])
+
+    p.fc_voxelwise_all_glm(covariates_file, contrasts=['age'])
+
+    _, X = GroupDesign(covariates_file).matrix(session_ids)
+    for name in seed_names:
+        Y = np.array([zmaps[s, name] for s in session_ids])
+        expected = np.linalg.lstsq(X, Y, rcond=None)[0]
+        betas = nib.load(os.path.join(p.dir_grp_vols_glm, '{}_betas.nii.gz'.format(name))).get_data()
+        assert np.allclose(betas[small_mask].T, expected, atol=1e-5)
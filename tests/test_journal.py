@@ -0,0 +1,60 @@
+import errno
+import pytest
+
+from rsfmri.executor import CommandError
+from rsfmri.journal import TaskOutcome, JobJournal, is_transient, run_with_retries
+
+
+def flaky(errors):
+    calls = []
+    def func(*args, **kwargs):
+        calls.append((args, kwargs))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+    return func, calls
+
+
+def test_is_transient():
+    assert is_transient(CommandError('fslmaths', 1))
+    assert is_transient(IOError(errno.ESTALE, 'stale handle'))
+    assert not is_transient(IOError(errno.ENOENT, 'no such file'))
+    assert not is_transient(ValueError('bad'))
+
+
+def test_retry_transient():
+    func, calls = flaky([CommandError('fslmaths', 1, 'tool output')])
+    outcome = run_with_retries('a', func, (1,), {'b': 2}, retries=1, delay=0)
+    assert outcome.status == 'ok' and outcome.attempts == 2 and outcome.error is None
+    assert calls == [((1,), {'b': 2})] * 2
+
+
+def test_retries_exhausted():
+    func, calls = flaky([CommandError('fslmaths', 1, 'tool output')] * 3)
+    outcome = run_with_retries('a', func, retries=1, delay=0)
+    assert outcome.status == 'failed' and outcome.attempts == 2 and len(calls) == 2
+    assert 'CommandError' in outcome.error and 'tool output' in outcome.error
+
+
+@pytest.mark.parametrize('error', [ValueError('bad'), IOError(errno.ENOENT, 'missing'), SystemExit(1)])
+def test_no_retry(error):
+    func, calls = flaky([error])
+    outcome = run_with_retries('a', func, retries=3, delay=0)
+    assert outcome.status == 'failed' and outcome.attempts == 1 and len(calls) == 1
+
+
+def test_journal_latest(tmpdir):
+    main = JobJournal(str(tmpdir))
+    worker = JobJournal(str(tmpdir), suffix='node1')
+    main.record(TaskOutcome('a', 'failed', 2, 'boom', 1.))
+    worker.record(TaskOutcome('b', 'failed', 1, 'boom', 1.))
+    main.record(TaskOutcome('a', 'ok', 1, None, 1.))
+    main.record(TaskOutcome('c', 'ok', 1, None, 1.))
+    worker.record(TaskOutcome('c', 'skipped', 0, None, 0.))
+    # interrupted write
+    with open(main.filename, 'a') as f:
+        f.write('{"task": "d", "sta')
+
+    latest = main.latest()
+    assert sorted(latest) == ['a', 'b', 'c']
+    assert latest['a'].status == 'ok' and latest['c'].status == 'ok'
+    assert main.failures() == [TaskOutcome('b', 'failed', 1, 'boom', 1.)]
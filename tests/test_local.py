@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from rsfmri.local import alff, neighborhood_offsets, neighbor_indices, timecourse_ranks, reho
+
+
+def kendall_w(ts):
+    # ts: [raters, frames]
+    k, n = ts.shape
+    ranks = ts.argsort(axis=1).argsort(axis=1) + 1
+    rsum  = ranks.sum(axis=0)
+    return 12. * ((rsum - k * (n + 1) / 2.)**2).sum() / (k**2 * (n**3 - n))
+
+
+def test_alff_band_and_out_of_band():
+    tr, n = 2., 100
+    t = np.arange(n) * tr
+    # 0.05 Hz falls in the band, 0.2 Hz outside of it (both on fft bins)
+    data = np.vstack([np.sin(2 * np.pi * 0.05 * t) + 10,
+                      np.sin(2 * np.pi * 0.2 * t) + 10,
+                      np.ones(n)])
+    a, fa = alff(data, tr)
+    assert a[0] > 0 and np.isclose(fa[0], 1)
+    assert np.isclose(a[1], 0) and np.isclose(fa[1], 0)
+    assert a[2] == 0 and fa[2] == 0
+
+
+def test_alff_block_size():
+    data = np.random.RandomState(0).randn(50, 80)
+    a, fa = alff(data, 2.)
+    ab, fab = alff(data, 2., block_size=7)
+    assert np.allclose(a, ab) and np.allclose(fa, fab)
+
+
+def test_neighborhood_offsets():
+    assert [len(neighborhood_offsets(s)) for s in (7, 19, 27)] == [7, 19, 27]
+    with pytest.raises(ValueError):
+        neighborhood_offsets(9)
+
+
+def test_neighbor_indices():
+    mask = np.zeros((3, 3, 3), dtype=bool)
+    mask[1, 1, :] = True
+    mask[0, 1, 1] = True
+    nb = neighbor_indices(mask, size=7)
+    index = -np.ones(mask.shape, dtype=int)
+    index[mask] = np.arange(mask.sum())
+    for v, (x, y, z) in enumerate(zip(*np.nonzero(mask))):
+        expected = set()
+        for dx, dy, dz in neighborhood_offsets(7):
+            c = (x + dx, y + dy, z + dz)
+            if all(0 <= ci < 3 for ci in c) and mask[c]:
+                expected.add(index[c])
+        assert set(nb[v][nb[v] >= 0]) == expected
+
+
+def test_timecourse_ranks():
+    data = np.random.RandomState(0).randn(10, 20)
+    ranks = timecourse_ranks(data, block_size=3)
+    assert np.array_equal(ranks, data.argsort(axis=1).argsort(axis=1) + 1)
+
+
+def test_reho_matches_kendall_w():
+    mask = np.ones((4, 3, 3), dtype=bool)
+    mask[0, 0, 0] = False
+    data = np.random.RandomState(0).randn(mask.sum(), 30)
+    nb = neighbor_indices(mask, size=19)
+    w = reho(data, nb, block_size=5)
+    for v in range(len(data)):
+        assert np.isclose(w[v], kendall_w(data[nb[v][nb[v] >= 0]]))
+
+
+def test_reho_identical_timecourses():
+    mask = np.ones((3, 3, 3), dtype=bool)
+    data = np.tile(np.random.RandomState(0).randn(25), (27, 1))
+    assert np.allclose(reho(data, neighbor_indices(mask)), 1)
@@ -0,0 +1,42 @@
+import argparse
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import make_project
+from rsfmri import manifest
+from rsfmri.manifest import SessionManifest
+from rsfmri.args import file_input_type
+
+
+def save_volume(filename, shape, tr=2.):
+    img = nib.Nifti1Image(np.zeros(shape, dtype=np.float32), np.eye(4))
+    img.get_header().set_zooms((1., 1., 1., tr)[:len(shape)])
+    nib.save(img, filename)
+
+
+# cache of a new --output directory (created by the manifest, before the project)
+def test_manifest_cache_in_new_output_dir(tmpdir, monkeypatch):
+    standard = str(tmpdir.join('standard.nii'))
+    save_volume(standard, (4, 5, 3))
+    monkeypatch.setattr(manifest, 'mri_standard', standard)
+
+    p = make_project(tmpdir, ['0012'])
+    save_volume(p.sessions[0].bold, (4, 5, 3, 10))
+
+    cache = tmpdir.join('new', 'output', '.rsfmri_manifest.json')
+    m = SessionManifest(str(cache))
+    m.build(p.sessions)
+    assert cache.check(file=True)
+    assert m.invalid() == []
+    assert p.sessions[0].info['frames'] == 10
+
+    # headers are read from the cache
+    m = SessionManifest(str(cache))
+    assert str(p.sessions[0].bold) in m.cache
+
+
+def test_missing_input_is_an_error(tmpdir):
+    with pytest.raises(argparse.ArgumentTypeError):
+        file_input_type(str(tmpdir.join('missing')))
+    assert file_input_type(str(tmpdir)) == str(tmpdir)
@@ -0,0 +1,74 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from rsfmri.masked import MaskedStack, unmask
+
+
+def test_unmask(small_mask):
+    values = np.arange(small_mask.sum(), dtype=np.float32)
+    vol = unmask(values).get_data()
+    assert vol.shape == small_mask.shape
+    assert np.array_equal(vol[small_mask], values) and not vol[~small_mask].any()
+
+    vol4 = unmask(np.vstack([values, -values])).get_data()
+    assert vol4.shape == small_mask.shape + (2,)
+    assert np.array_equal(vol4[small_mask].T, [values, -values])
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_append_and_read(tmpdir, small_mask, dtype):
+    stack = MaskedStack(str(tmpdir.join('seed')), dtype)
+    values = np.random.RandomState(0).randn(3, small_mask.sum())
+    for sid, v in zip(['0012', '0003', '0101'], values):
+        stack.append(sid, v)
+
+    assert stack.sessions() == ['0003', '0012', '0101']
+    assert '0012' in stack and '12' not in stack
+    assert stack.data().dtype == np.dtype(dtype)
+    assert np.allclose(stack.row('0003'), values[1].astype(dtype))
+    assert np.allclose(stack.rows(['0101', '0012']), values[[2, 0]].astype(dtype))
+
+
+def test_rewrite_and_other_writers(tmpdir, small_mask):
+    base = str(tmpdir.join('seed'))
+    stack = MaskedStack(base)
+    n = small_mask.sum()
+    stack.append('a', np.zeros(n))
+    stack.append('b', np.ones(n))
+    stack.rows(['a', 'b'])
+
+    # last entry wins; rows appended by another writer are picked up
+    stack.append('a', np.full(n, 2.))
+    MaskedStack(base).append('c', np.full(n, 3.))
+    assert stack.sessions() == ['a', 'b', 'c']
+    assert np.array_equal(stack.rows(['a', 'b', 'c'])[:, 0], [2, 1, 3])
+    assert len(stack.data()) == 4
+
+
+def test_partial_row(tmpdir, small_mask):
+    base = str(tmpdir.join('seed'))
+    stack = MaskedStack(base)
+    n = small_mask.sum()
+    stack.append('a', np.ones(n))
+    # a write that died halfway leaves part of a row behind
+    with open(stack.file_data, 'ab') as f:
+        f.write(b'\0' * 10)
+    stack.append('b', np.full(n, 2.))
+    assert np.array_equal(stack.rows(['a', 'b'])[:, 0], [1, 2])
+
+
+def test_append_wrong_size(tmpdir, small_mask):
+    stack = MaskedStack(str(tmpdir.join('seed')))
+    with pytest.raises(ValueError):
+        stack.append('a', np.zeros(small_mask.sum() + 1))
+    assert stack.sessions() == []
+
+
+def test_to_nifti(tmpdir, small_mask):
+    stack = MaskedStack(str(tmpdir.join('seed')))
+    values = np.random.RandomState(0).randn(small_mask.sum()).astype(np.float32)
+    stack.append('a', values)
+    filename = str(tmpdir.join('a.nii.gz'))
+    stack.to_nifti('a', filename)
+    assert np.array_equal(nib.load(filename).get_data()[small_mask], values)
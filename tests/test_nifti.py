@@ -0,0 +1,66 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from rsfmri.nifti import NiftiSeries, save_nifti, load_nifti
+
+
+def save_run(tmpdir, name, data):
+    filename = str(tmpdir.join(name))
+    save_nifti(nib.Nifti1Image(data.astype(np.float32), np.eye(4)), filename)
+    return filename
+
+
+@pytest.fixture
+def runs(tmpdir):
+    rng = np.random.RandomState(0)
+    data = [rng.randn(3, 4, 2, 7) * 5 + 100, rng.randn(3, 4, 2, 5) * 2 + 50]
+    files = [save_run(tmpdir, 'run1.nii.gz', data[0]), save_run(tmpdir, 'run2.nii', data[1])]
+    return files, data
+
+
+def test_series_concatenates_runs(runs):
+    files, data = runs
+    series = NiftiSeries(files, block_size=3)
+    full = np.concatenate(data, axis=3).astype(np.float32)
+    assert series.shape == (3, 4, 2, 12)
+    assert np.allclose(series[8], full[..., 8])
+
+    blocks = list(series.iter_blocks())
+    assert [start for start, _ in blocks] == [0, 3, 6, 7, 10]
+    assert np.allclose(np.concatenate([b for _, b in blocks], axis=3), full)
+
+
+def test_series_zscore_per_run(runs):
+    files, data = runs
+    mask = np.ones((3, 4, 2), dtype=bool)
+    mask[0] = False
+    series = NiftiSeries(files, demean='zscore', block_size=4)
+    out = np.concatenate([b for _, b in series.iter_blocks(mask)], axis=1)
+
+    expected = [(d[mask] - d[mask].mean(axis=1)[:, np.newaxis]) / d[mask].std(axis=1)[:, np.newaxis]
+                    for d in data]
+    assert np.allclose(out, np.concatenate(expected, axis=1), atol=1e-4)
+
+
+# group statistics read 3d maps (one per session) as a series
+def test_series_of_3d_maps(tmpdir):
+    rng = np.random.RandomState(1)
+    maps = [rng.randn(3, 4, 2) for _ in range(3)]
+    files = [save_run(tmpdir, 'map{}.nii.gz'.format(k), m) for k, m in enumerate(maps)]
+    files[1] = save_run(tmpdir, 'map1.nii', maps[1])
+
+    series = NiftiSeries(files, demean='mean')
+    assert series.shape == (3, 4, 2, 3)
+    out = np.concatenate([b for _, b in series.iter_blocks()], axis=3)
+    assert np.allclose(out, 0, atol=1e-5)   # every map is its own "run"
+
+    series = NiftiSeries(files)
+    for k, m in enumerate(maps):
+        assert np.allclose(series[k], m, atol=1e-6)
+
+
+def test_load_nifti_gz(tmpdir):
+    data = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    filename = save_run(tmpdir, 'vol.nii.gz', data)
+    assert np.allclose(load_nifti(filename).get_data(), data)
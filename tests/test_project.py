@@ -0,0 +1,41 @@
+import os
+import numpy as np
+
+from conftest import make_project, session_timecourses, seed_names
+from rsfmri.utils import read_session_csv
+
+
+def matrix_csv(p, name):
+    return os.path.join(p.dir_grp_csv, 'fc_pearson_{}.csv'.format(name))
+
+
+def check_matrices(p, session_ids):
+    for i, name in enumerate(seed_names):
+        df = read_session_csv(matrix_csv(p, name))
+        assert sorted(df.index) == sorted(session_ids)
+        for session_id in session_ids:
+            expected = np.corrcoef(session_timecourses(session_id).T)[i]
+            assert np.allclose(df.loc[session_id, seed_names].values.astype(float), expected, atol=1e-4)
+
+    mean = read_session_csv(os.path.join(p.dir_grp_csv, 'fc_pearson_group_mean.csv'))
+    expected = np.mean([np.corrcoef(session_timecourses(s).T) for s in session_ids], axis=0)
+    assert np.allclose(mean.loc[seed_names, seed_names].values, expected, atol=1e-4)
+
+
+# sessions added/removed with --update keep earlier (zero-padded) session ids
+def test_matrix_update_round_trip(tmpdir, no_figures):
+    first = ['0012', '0013', '0100']
+    p = make_project(tmpdir, first)
+    p.fc_matrix_groupstats('pearson')
+    check_matrices(p, first)
+
+    added = first + ['0200', '0300']
+    p = make_project(tmpdir, added, update=True)
+    p.fc_matrix_groupstats('pearson')
+    check_matrices(p, added)
+
+    # removed session is subtracted (values read back from the csv files)
+    removed = ['0012', '0100', '0200', '0300']
+    p = make_project(tmpdir, removed, update=True)
+    p.fc_matrix_groupstats('pearson')
+    check_matrices(p, removed)
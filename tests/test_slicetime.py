@@ -0,0 +1,66 @@
+import os
+import imp
+import argparse
+import numpy as np
+import nibabel as nib
+from nibabel.orientations import io_orientation, axcodes2ornt, ornt_transform
+
+slicetime = imp.load_source('slicetime', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      'rsfmri_slicetime'))
+
+
+def args(**kwargs):
+    defaults = dict(skip=0, orient=None, tr=None, sidecar=None, order='up', ref=None, procs=2)
+    return argparse.Namespace(**dict(defaults, **kwargs))
+
+
+# slow sinusoid: shifted series is the sinusoid at shifted times (away from the ends)
+def test_phase_shift():
+    t = np.arange(200)
+    data = np.array([np.sin(2 * np.pi * t / 50.), np.cos(2 * np.pi * t / 40.)]) + 3
+    shifted = slicetime.phase_shift((data, 0.4))
+    expected = np.array([np.sin(2 * np.pi * (t + .4) / 50.), np.cos(2 * np.pi * (t + .4) / 40.)]) + 3
+    assert np.allclose(shifted[:, 20:-20], expected[:, 20:-20], atol=1e-2)
+
+
+def test_slice_order():
+    assert slicetime.slice_order(5, 'odd') == [0, 2, 4, 1, 3]
+    assert slicetime.slice_order(3, 'down') == [2, 1, 0]
+
+
+# without dim_info, the slice axis is the input axis that becomes output axis 2
+def test_fallback_slice_axis():
+    header = nib.Nifti1Header()
+    assert slicetime.input_slice_axis(header) == 2
+
+    # input axes are (S, A, R): axis 0 becomes the 3rd (I-S) axis of RPI
+    affine = np.array([[0, 0, 1, 0], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]], dtype=float)
+    transform = ornt_transform(io_orientation(affine), axcodes2ornt(slicetime.afni_axcodes('RPI')))
+    assert slicetime.input_slice_axis(header, transform) == 0
+
+    header.set_dim_info(slice=1)
+    assert slicetime.input_slice_axis(header, transform) == 1
+
+
+def test_slice_time_correct(tmpdir):
+    rng = np.random.RandomState(0)
+    data = np.ones((4, 5, 3, 20), dtype=np.float32) * 100 + rng.randn(4, 5, 3, 20).astype(np.float32)
+    data[..., :2] = 0   # frames that are skipped
+    img = nib.Nifti1Image(data, np.diag([2., 2., 3., 1.]))
+    img.get_header().set_zooms((2., 2., 3., 2.))
+    infile, outfile = str(tmpdir.join('in.nii.gz')), str(tmpdir.join('out.nii'))
+    nib.save(img, infile)
+
+    slicetime.slice_time_correct(args(input=infile, output=outfile, skip=2, orient='RPI'))
+    out = nib.load(outfile)
+    assert out.shape == (4, 5, 3, 18)
+    assert out.get_header().get_zooms() == (2., 2., 3., 2.)
+    assert out.get_affine()[0, 0] == -2.
+
+    # slices (ascending, TR 2s) are shifted to the middle of the TR;
+    # RPI flips the 1st axis of RAS input
+    expected = np.empty((4, 5, 3, 18))
+    for k in range(3):
+        shift = (1. - k * 2. / 3) / 2.
+        expected[:, :, k] = slicetime.phase_shift((data[:, :, k, 2:].reshape(-1, 18), shift)).reshape(4, 5, 18)
+    assert np.allclose(out.get_data()[::-1], expected, atol=1e-4)
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import threading
+import pytest
+
+from rsfmri.spool import WorkSpool, run_worker
+
+
+@pytest.fixture
+def spool(tmpdir):
+    spool = WorkSpool(str(tmpdir.join('spool')), lease=60)
+    spool.create()
+    spool.create()
+    return spool
+
+
+def payload(spool, state, task_id):
+    with open(spool.path(state, task_id)) as f:
+        return json.load(f)
+
+
+def test_claim_by_stage(spool):
+    spool.add(1, 'groupstats', {'n': 2})
+    spool.add(0, 'a', {'n': 0})
+    spool.add(0, 'b', {'n': 1})
+
+    first, p = spool.claim()
+    second, _ = spool.claim()
+    assert (first, p) == ('0_a', {'n': 0}) and second == '0_b'
+    # stage 1 waits for stage 0 to finish
+    assert spool.claim() == (None, None)
+    assert not spool.drained()
+
+    spool.complete(first)
+    spool.fail(second, 'boom')
+    assert spool.claim() == ('1_groupstats', {'n': 2})
+    assert payload(spool, 'done', first)['worker'] == spool.worker
+    assert payload(spool, 'failed', second)['error'] == 'boom'
+    assert spool.claims == set(['1_groupstats'])
+
+
+def test_add_clears_earlier_outcome(spool):
+    task_id = spool.add(0, 'a', {})
+    spool.claim()
+    spool.fail(task_id, 'boom')
+    spool.add(0, 'a', {})
+    assert spool.tasks('failed') == [] and spool.tasks('pending') == [task_id]
+
+
+def test_recover_stale(spool):
+    task_id = spool.add(0, 'a', {})
+    spool.claim()
+    spool.recover_stale()
+    assert spool.tasks('claimed') == [task_id]
+
+    old = time.time() - 120
+    os.utime(spool.path('claimed', task_id), (old, old))
+    spool.recover_stale()
+    assert spool.tasks('pending') == [task_id]
+
+    # the original worker finishes late: nothing is lost or duplicated
+    spool.complete(task_id)
+    assert spool.tasks('pending') == [task_id] and spool.tasks('done') == []
+
+
+def test_run_worker(spool):
+    ran, lock = [], threading.Lock()
+
+    def run_task(p):
+        if p['fail']:
+            raise RuntimeError('task failed')
+        with lock:
+            ran.append(p['n'])
+
+    for n in range(6):
+        spool.add(n % 2, str(n), {'n': n, 'fail': n == 3})
+    run_worker(spool, run_task, threads=3, poll=0.01)
+
+    assert spool.drained()
+    assert sorted(ran) == [0, 1, 2, 4, 5]
+    # all of stage 0 ran before stage 1
+    assert sorted(ran[:3]) == [0, 2, 4]
+    assert spool.tasks('failed') == ['1_3']
+    assert 'task failed' in payload(spool, 'failed', '1_3')['error']